@@ -0,0 +1,132 @@
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+
+# Seconds a cached answer is served before the question is answered afresh
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Answers kept per container across all users, least recently used evicted first
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+# Shingle (Jaccard) similarity above which a differently worded question reuses an answer
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.8"))
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'can', 'could', 'do', 'does', 'for', 'from', 'i',
+    'in', 'is', 'it', 'me', 'my', 'of', 'on', 'or', 'please', 'should', 'tell', 'that', 'the',
+    'to', 'was', 'what', 'which', 'with', 'would', 'you', 'your'
+})
+# Words that refer back to the conversation; the answer to such a question depends on the chat history
+HISTORY_REFERENCES = frozenset({
+    'above', 'again', 'also', 'before', 'earlier', 'elaborate', 'else', 'expand', 'first', 'instead', 'it',
+    'its', 'last', 'more', 'previous', 'same', 'that', 'them', 'these', 'they', 'this', 'those'
+})
+
+# (email, fingerprint) -> {"scope", "shingles", "anchors", "answer", "stored_at"}
+_entries = OrderedDict()
+# email -> fingerprints cached for that user
+_user_fingerprints = {}
+
+
+def question_tokens(question):
+    """Lower-cased content words of a question"""
+    return [token for token in TOKEN_PATTERN.findall((question or '').lower()) if token not in STOPWORDS]
+
+
+def fingerprint(tokens):
+    """Fingerprint of a normalized question; word order is kept, since p4 to p5 is not p5 to p4"""
+    return hashlib.sha256(" ".join(tokens).encode('utf-8')).hexdigest()[:16]
+
+
+def depends_on_history(question):
+    """Whether a question refers back to the conversation, so its answer must not be cached or reused"""
+    return any(word in HISTORY_REFERENCES for word in TOKEN_PATTERN.findall((question or '').lower()))
+
+
+def shingles(tokens):
+    """Words plus adjacent word pairs, so rewordings score high but reorderings of meaning do not"""
+    return set(tokens) | {f"{first} {second}" for first, second in zip(tokens, tokens[1:])}
+
+
+def _anchors(tokens):
+    # Tokens with digits (levels like p4, years) must match exactly: "get to p4" is not "get to p5"
+    return frozenset(token for token in tokens if any(char.isdigit() for char in token))
+
+
+def cache_scope(artifact_hash, matrix_version, evaluated_at):
+    """What a user's answers depend on; a new upload, matrix or evaluation changes it"""
+    return (artifact_hash, matrix_version, evaluated_at)
+
+
+def invalidate(email):
+    for key in _user_fingerprints.pop(email, set()):
+        _entries.pop((email, key), None)
+
+
+def _evict(cache_key):
+    _entries.pop(cache_key, None)
+    email, key = cache_key
+    _user_fingerprints.get(email, set()).discard(key)
+
+
+def lookup(email, question, scope):
+    """Cached answer to the same or a similar question from this user, or None"""
+    tokens = question_tokens(question)
+    if not tokens or depends_on_history(question):
+        return None
+    key = fingerprint(tokens)
+    user_keys = _user_fingerprints.get(email)
+    if not user_keys:
+        return None
+
+    now = time.time()
+    candidates = [key] if key in user_keys else []
+    candidates += [other for other in user_keys if other != key]
+    question_shingles = shingles(tokens)
+    anchors = _anchors(tokens)
+    for candidate in candidates:
+        cache_key = (email, candidate)
+        entry = _entries.get(cache_key)
+        if entry is None:
+            continue
+        if entry['scope'] != scope:
+            # A scope change invalidates everything cached for the user
+            print(f"Answer cache invalidated for {email}")
+            invalidate(email)
+            return None
+        if now - entry['stored_at'] > ANSWER_CACHE_TTL:
+            _evict(cache_key)
+            continue
+        if candidate != key:
+            if entry['anchors'] != anchors:
+                continue
+            union = question_shingles | entry['shingles']
+            similarity = len(question_shingles & entry['shingles']) / len(union)
+            if similarity < ANSWER_CACHE_SIMILARITY:
+                continue
+            print(f"Answer cache hit for {email} at similarity {similarity:.2f}")
+        else:
+            print(f"Answer cache hit for {email}")
+        _entries.move_to_end(cache_key)
+        return entry['answer']
+    return None
+
+
+def store(email, question, scope, answer):
+    tokens = question_tokens(question)
+    if not tokens or not answer or depends_on_history(question):
+        return
+    key = fingerprint(tokens)
+    cache_key = (email, key)
+    _entries[cache_key] = {
+        'scope': scope,
+        'shingles': shingles(tokens),
+        'anchors': _anchors(tokens),
+        'answer': answer,
+        'stored_at': time.time()
+    }
+    _entries.move_to_end(cache_key)
+    _user_fingerprints.setdefault(email, set()).add(key)
+    while len(_entries) > ANSWER_CACHE_MAX_ENTRIES:
+        _evict(next(iter(_entries)))
@@ -0,0 +1,170 @@
+import hashlib
+import io
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import deadline
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+ARTIFACT_PREPROCESSING = os.getenv("ARTIFACT_PREPROCESSING", "false").lower() == "true"
+PROCESSED_PREFIX = os.getenv("PROCESSED_PREFIX", "processed/")
+# Manifests live outside PROCESSED_PREFIX so the knowledge base never indexes them
+PROCESSED_MANIFEST_PREFIX = os.getenv("PROCESSED_MANIFEST_PREFIX", "processed-manifests/")
+# Name of the raw artifact copied under the user's prefix when a PDF has no text layer
+RAW_ARTIFACT_NAME = "artifact.pdf"
+CHUNK_CHARS = int(os.getenv("CHUNK_CHARS", "1500"))
+MAX_UPLOAD_WORKERS = 8
+
+HYPHENATED_BREAK_PATTERN = re.compile(r'(\w)-\n(\w)')
+CONTROL_CHAR_PATTERN = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+PARAGRAPH_BREAK_PATTERN = re.compile(r'\n\s*\n')
+SENTENCE_END_PATTERN = re.compile(r'(?<=[.!?])\s+')
+
+
+def preprocessing_enabled():
+    return ARTIFACT_PREPROCESSING and PdfReader is not None
+
+
+def iter_page_texts(content):
+    """Yield (page number, text) one page at a time; pypdf parses pages lazily"""
+    reader = PdfReader(io.BytesIO(content))
+    for page_number, page in enumerate(reader.pages, 1):
+        try:
+            yield page_number, page.extract_text() or ''
+        except Exception as e:
+            print(f"Skipping page {page_number}: {str(e)}")
+
+
+def normalize_text(text):
+    """Join hyphenated line breaks, drop control characters and collapse whitespace within paragraphs"""
+    text = CONTROL_CHAR_PATTERN.sub('', text.replace('\r\n', '\n').replace('\r', '\n'))
+    text = HYPHENATED_BREAK_PATTERN.sub(r'\1\2', text)
+    paragraphs = (" ".join(paragraph.split()) for paragraph in PARAGRAPH_BREAK_PATTERN.split(text))
+    return "\n\n".join(paragraph for paragraph in paragraphs if paragraph)
+
+
+def _pieces(paragraph, limit):
+    """Split an oversized paragraph on sentence ends, and hard-split sentences that are still too long"""
+    if len(paragraph) <= limit:
+        yield paragraph
+        return
+    for sentence in SENTENCE_END_PATTERN.split(paragraph):
+        for start in range(0, len(sentence), limit):
+            yield sentence[start:start + limit]
+
+
+def chunk_text(text, limit=CHUNK_CHARS):
+    """Greedily pack paragraphs into chunks of at most limit characters"""
+    chunks = []
+    current = ''
+    for paragraph in text.split("\n\n"):
+        separator = "\n\n"
+        for piece in _pieces(paragraph, limit):
+            if current and len(current) + len(separator) + len(piece) > limit:
+                chunks.append(current)
+                current = ''
+            current = f"{current}{separator}{piece}" if current else piece
+            # Sentences of one paragraph stay on one line
+            separator = " "
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_id(text):
+    """Stable ID of a chunk: unchanged text keeps its ID, and so its object, across uploads"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:20]
+
+
+def extract_chunks(content):
+    """Chunks of a PDF as {chunk id: {"text", "page"}}, in page order; chunks never span pages"""
+    chunks = {}
+    for page_number, page_text in iter_page_texts(content):
+        for text in chunk_text(normalize_text(page_text)):
+            chunks.setdefault(chunk_id(text), {"text": text, "page": page_number})
+    return chunks
+
+
+def _user_prefix(email):
+    return f"{PROCESSED_PREFIX}{email.split('@')[0]}/"
+
+
+def _manifest_key(email):
+    return f"{PROCESSED_MANIFEST_PREFIX}{email.split('@')[0]}.json"
+
+
+def _load_manifest(s3, bucket, key):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+        return json.loads(response['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        return {}
+
+
+def _delete_objects(s3, bucket, keys):
+    for start in range(0, len(keys), 1000):
+        s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]],
+                                                 'Quiet': True})
+
+
+def preprocess_artifact(bucket, content, metadata, artifact_hash):
+    """Extract, chunk and write an artifact's text; returns the manifest, or None when not preprocessed
+
+    metadata is the artifact's knowledge-base sidecar; each chunk's sidecar
+    adds its page and chunk ID to those attributes. A PDF without a text
+    layer is copied under the user's prefix as is, with its sidecar, for the
+    knowledge base to parse.
+    """
+    if not preprocessing_enabled():
+        return None
+
+    attributes = metadata["metadataAttributes"]
+    chunks = extract_chunks(content)
+
+    s3 = deadline.client('s3', 30, region_name='us-east-1')
+    prefix = _user_prefix(attributes["email"])
+    manifest_key = _manifest_key(attributes["email"])
+    manifest = _load_manifest(s3, bucket, manifest_key)
+    previous = set(manifest.get("chunks", []))
+    # Changed form fields change every chunk's sidecar, so all chunks are rewritten
+    metadata_hash = chunk_id(json.dumps(attributes, sort_keys=True))
+    if manifest.get("metadata_hash") != metadata_hash:
+        previous = set()
+    new_ids = [key for key in chunks if key not in previous]
+    stale_ids = sorted(set(manifest.get("chunks", [])) - set(chunks))
+    stale_keys = [f"{prefix}{key}{suffix}" for key in stale_ids for suffix in ('.txt', '.txt.metadata.json')]
+    raw_key = f"{prefix}{RAW_ARTIFACT_NAME}"
+
+    if chunks:
+        def write_chunk(key):
+            chunk = chunks[key]
+            s3.put_object(Bucket=bucket, Key=f"{prefix}{key}.txt", ContentType='text/plain; charset=utf-8',
+                          Body=chunk["text"].encode('utf-8'))
+            sidecar = {"metadataAttributes": dict(attributes, page=chunk["page"], chunk_id=key)}
+            s3.put_object(Bucket=bucket, Key=f"{prefix}{key}.txt.metadata.json", ContentType='application/json',
+                          Body=json.dumps(sidecar))
+
+        with ThreadPoolExecutor(max_workers=MAX_UPLOAD_WORKERS) as executor:
+            list(executor.map(write_chunk, new_ids))
+        if manifest.get("raw_copy"):
+            stale_keys += [raw_key, f"{raw_key}.metadata.json"]
+    else:
+        print("No text layer found, copying the raw artifact for the knowledge base to parse")
+        s3.put_object(Bucket=bucket, Key=raw_key, ContentType='application/pdf', Body=content)
+        s3.put_object(Bucket=bucket, Key=f"{raw_key}.metadata.json", ContentType='application/json',
+                      Body=json.dumps(metadata))
+
+    _delete_objects(s3, bucket, stale_keys)
+
+    manifest = {"artifact_hash": artifact_hash, "metadata_hash": metadata_hash, "chunks": list(chunks),
+                "raw_copy": not chunks}
+    s3.put_object(Bucket=bucket, Key=manifest_key, ContentType='application/json', Body=json.dumps(manifest))
+    print(f"Preprocessed artifact into {len(chunks)} chunks: "
+          f"{len(new_ids)} new, {len(chunks) - len(new_ids)} unchanged, {len(stale_ids)} removed")
+    return manifest
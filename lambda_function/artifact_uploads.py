@@ -0,0 +1,88 @@
+import json
+from datetime import datetime
+
+import deadline
+import records
+
+ARTIFACT_BUCKET = 'elev8ai'
+
+# Form fields carried as object metadata by presigned uploads, and the marker of such uploads
+UPLOAD_METADATA_FIELDS = ('email', 'name', 'to_designation', 'from_designation')
+UPLOAD_MODE_METADATA = 'upload-mode'
+PRESIGNED_UPLOAD_MODE = 'presigned'
+
+
+def artifact_key(email):
+    """S3 key of a user's artifact; its metadata sidecar is the key plus .metadata.json"""
+    user = email.split("@")[0]
+    return f'artifacts/{user}/{user}.pdf'
+
+
+def object_metadata_name(field):
+    """S3 user-metadata name of a form field, e.g. to_designation -> to-designation"""
+    return field.replace('_', '-')
+
+
+def build_metadata(email, name, to_designation, from_designation):
+    """Knowledge-base metadata sidecar, whose email attribute scopes retrieval to the user"""
+    return {
+        "metadataAttributes": {
+            "email": email,
+            "name": name,
+            "to_designation": to_designation,
+            "from_designation": from_designation,
+            "tags": ["artifact", "arko tags"]
+        }
+    }
+
+
+def read_metadata(email, bucket=ARTIFACT_BUCKET):
+    """Attributes of the user's artifact sidecar, e.g. the designations it was uploaded for; {} if it has none"""
+    try:
+        response = deadline.client('s3', 10, region_name='us-east-1').get_object(
+            Bucket=bucket, Key=f"{artifact_key(email)}.metadata.json"
+        )
+        return json.loads(response['Body'].read()).get('metadataAttributes', {})
+    except Exception as e:
+        print(f"Error reading artifact metadata for {email}: {str(e)}")
+        return {}
+
+
+def update_sync_status(email, status, error_message=None, artifact_hash=None):
+    """Update the user's STATUS record without affecting other attributes
+
+    A sync status means the artifact arrived, so any pending presigned upload
+    is cleared.
+    """
+    try:
+        records.update_status(email, {
+            'status': status,
+            'last_updated': datetime.utcnow().isoformat(),
+            'error_message': error_message,
+            'artifact_hash': artifact_hash
+        }, remove=('upload_requested_at',))
+    except Exception as e:
+        print(f"Error updating DynamoDB: {str(e)}")
+        raise
+
+
+def record_upload_request(email):
+    """Note a presigned upload on the STATUS record, leaving the sync status of the current artifact as it is"""
+    try:
+        records.update_status(email, {'upload_requested_at': datetime.utcnow().isoformat()})
+    except Exception as e:
+        print(f"Error updating DynamoDB: {str(e)}")
+        raise
+
+
+def start_ingestion(knowledge_base_id, data_source_id):
+    """Start a knowledge base sync; failures are logged since polling reports the outcome"""
+    try:
+        deadline.client('bedrock-agent', 10, region_name='us-east-1').start_ingestion_job(
+            knowledgeBaseId=knowledge_base_id,
+            dataSourceId=data_source_id
+        )
+        return True
+    except Exception as e:
+        print(f"Error starting sync job: {str(e)}")
+        return False
@@ -0,0 +1,258 @@
+import os
+import random
+import threading
+import time
+
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError, ReadTimeoutError
+
+import deadline
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+RATE_LIMIT_TABLE = os.getenv("RATE_LIMIT_TABLE", "Elev8-ai-rate-limits")
+RATE_LIMIT_BUCKET = os.getenv("RATE_LIMIT_BUCKET", "bedrock")
+BEDROCK_RATE_PER_SECOND = float(os.getenv("BEDROCK_RATE_PER_SECOND", "2"))
+BEDROCK_BURST = float(os.getenv("BEDROCK_BURST", "10"))
+INTERACTIVE_RESERVE = float(os.getenv("BEDROCK_INTERACTIVE_RESERVE", "3"))
+BEDROCK_MAX_IN_FLIGHT = int(os.getenv("BEDROCK_MAX_IN_FLIGHT", "4"))
+BEDROCK_MAX_ATTEMPTS = int(os.getenv("BEDROCK_MAX_ATTEMPTS", "4"))
+BEDROCK_CONNECT_TIMEOUT = 10
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BEDROCK_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BEDROCK_BREAKER_COOLDOWN", "30"))
+
+# Per priority: longest wait for admission (None: until the invocation deadline), longest Bedrock read timeout
+# (shortened to fit the invocation budget) and shortest budget worth starting a call with, in seconds
+MAX_ADMISSION_WAIT = {PRIORITY_INTERACTIVE: 5.0, PRIORITY_BACKGROUND: None}
+READ_TIMEOUTS = {PRIORITY_INTERACTIVE: 60, PRIORITY_BACKGROUND: 600}
+MIN_CALL_BUDGET = {PRIORITY_INTERACTIVE: 5.0, PRIORITY_BACKGROUND: 30.0}
+
+# Error codes that indicate Bedrock itself is struggling rather than a bad request
+DEGRADED_ERROR_CODES = {
+    'ThrottlingException', 'ServiceQuotaExceededException', 'ServiceUnavailableException',
+    'InternalServerException', 'ModelNotReadyException', 'ModelTimeoutException'
+}
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when a call could not be admitted within its wait budget"""
+
+
+class BedrockUnavailableError(Exception):
+    """Raised without calling Bedrock while the circuit breaker is open"""
+
+
+def build_bedrock_config(priority=PRIORITY_BACKGROUND, read_timeout=None, max_attempts=BEDROCK_MAX_ATTEMPTS):
+    """Client config with short connects, read timeouts bounded by priority and budget, and adaptive jittered retries"""
+    read_timeout = read_timeout or deadline.current().timeout(READ_TIMEOUTS[priority], "Bedrock")
+    return Config(
+        connect_timeout=min(BEDROCK_CONNECT_TIMEOUT, max(1, read_timeout / 4)),
+        read_timeout=int(read_timeout),
+        retries={'mode': 'adaptive', 'max_attempts': max_attempts},
+        max_pool_connections=max(10, BEDROCK_MAX_IN_FLIGHT)
+    )
+
+
+def bedrock_client(service, region_name, priority=PRIORITY_BACKGROUND):
+    """Bedrock client whose attempts, retries included, all fit in the remaining invocation budget
+
+    Clients are reused per standard timeout step, like deadline.client, so
+    the read timeout and the number of attempts shrink as the invocation
+    runs down.
+    """
+    # Each attempt may take its connect timeout (a quarter of the read timeout at most) plus its read timeout
+    budget = deadline.current().remaining() / 1.25
+    # Attempts are dropped before the read timeout is cut below its cap; callers retry failed calls themselves
+    attempts = max(1, min(BEDROCK_MAX_ATTEMPTS, int(budget // READ_TIMEOUTS[priority])))
+    read_timeout = deadline.timeout_step(min(READ_TIMEOUTS[priority], budget / attempts))
+    cache_key = (service, region_name, priority, read_timeout, attempts)
+    instance = _bedrock_clients.get(cache_key)
+    if instance is None:
+        with _bedrock_clients_lock:
+            instance = _bedrock_clients.get(cache_key)
+            if instance is None:
+                instance = deadline.create_client(
+                    service, region_name=region_name, config=build_bedrock_config(priority, read_timeout, attempts)
+                )
+                _bedrock_clients[cache_key] = instance
+    return instance
+
+
+class CircuitBreaker:
+    """Opens after consecutive degraded failures and lets one probe through after the cooldown"""
+
+    def __init__(self, failure_threshold, cooldown_seconds):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.time() - self.opened_at < self.cooldown_seconds or self.probe_in_flight:
+                raise BedrockUnavailableError("Bedrock is degraded, failing fast until the circuit closes")
+            self.probe_in_flight = True
+
+    def cancel_probe(self):
+        with self.lock:
+            self.probe_in_flight = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+                print(f"Bedrock circuit opened after {self.failures} consecutive failures")
+
+
+class InFlightLimit:
+    """Caps concurrent Bedrock calls from this container; priority across containers comes from the token bucket's reserve"""
+
+    def __init__(self, max_in_flight):
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+
+    def acquire(self, timeout):
+        if not self.slots.acquire(timeout=timeout):
+            raise AdmissionRejectedError("Timed out waiting for a Bedrock slot")
+
+    def release(self):
+        self.slots.release()
+
+
+# (service, region, priority, read timeout step, attempts) -> client
+_bedrock_clients = {}
+_bedrock_clients_lock = threading.Lock()
+circuit_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN_SECONDS)
+in_flight_limit = InFlightLimit(BEDROCK_MAX_IN_FLIGHT)
+
+
+def _take_token(priority):
+    """Try once to take a token from the shared bucket; returns seconds to wait, 0 when admitted"""
+    now_ms = int(time.time() * 1000)
+    dynamodb = deadline.client('dynamodb', 2)
+    item = dynamodb.get_item(
+        TableName=RATE_LIMIT_TABLE,
+        Key={'bucket': {'S': RATE_LIMIT_BUCKET}},
+        ConsistentRead=True
+    ).get('Item')
+
+    if item:
+        updated_at = int(item['updated_at']['N'])
+        tokens = float(item['tokens']['N'])
+        tokens = min(BEDROCK_BURST, tokens + (now_ms - updated_at) / 1000 * BEDROCK_RATE_PER_SECOND)
+    else:
+        updated_at = None
+        tokens = BEDROCK_BURST
+
+    # Background calls must leave the interactive reserve untouched
+    needed = 1 + (INTERACTIVE_RESERVE if priority != PRIORITY_INTERACTIVE else 0)
+    if tokens < needed:
+        return (needed - tokens) / BEDROCK_RATE_PER_SECOND
+
+    update = {
+        'TableName': RATE_LIMIT_TABLE,
+        'Key': {'bucket': {'S': RATE_LIMIT_BUCKET}},
+        'UpdateExpression': "SET #tokens = :tokens, #updated_at = :now",
+        'ExpressionAttributeNames': {'#tokens': 'tokens', '#updated_at': 'updated_at'},
+        'ExpressionAttributeValues': {
+            ':tokens': {'N': str(round(tokens - 1, 3))},
+            ':now': {'N': str(now_ms)}
+        }
+    }
+    if updated_at is None:
+        update['ConditionExpression'] = "attribute_not_exists(#updated_at)"
+    else:
+        update['ConditionExpression'] = "#updated_at = :previous"
+        update['ExpressionAttributeValues'][':previous'] = {'N': str(updated_at)}
+
+    try:
+        dynamodb.update_item(**update)
+        return 0
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            # Another container took a token first; retry almost immediately
+            return 0.01
+        raise
+
+
+def admission_wait(priority):
+    """Longest admission wait that still leaves time for the call itself"""
+    wait = deadline.current().remaining() - MIN_CALL_BUDGET[priority]
+    if MAX_ADMISSION_WAIT[priority] is not None:
+        wait = min(wait, MAX_ADMISSION_WAIT[priority])
+    return max(0.0, wait)
+
+
+def acquire_token(priority):
+    """Wait for a token from the shared bucket, failing open if the bucket itself is unavailable"""
+    if not RATE_LIMIT_TABLE:
+        return
+    wait_until = time.time() + admission_wait(priority)
+    while True:
+        try:
+            wait_seconds = _take_token(priority)
+        except (ClientError, BotoCoreError) as e:
+            print(f"Rate limit bucket unavailable, admitting without a token: {str(e)}")
+            return
+        if not wait_seconds:
+            return
+        wait_seconds *= random.uniform(1, 1.5)
+        if time.time() + wait_seconds > wait_until:
+            raise AdmissionRejectedError("Bedrock rate limit reached, try again shortly")
+        time.sleep(wait_seconds)
+
+
+def _is_degraded(error):
+    if isinstance(error, ClientError):
+        return error.response['Error']['Code'] in DEGRADED_ERROR_CODES
+    return isinstance(error, BotoCoreError)
+
+
+def call_bedrock(client, operation, priority=PRIORITY_BACKGROUND, service=None, **kwargs):
+    """Call a Bedrock operation under admission control
+
+    client supplies the region and, unless service names another Bedrock
+    service, the service; the call itself runs on a bedrock_client fitted to
+    the time left when it is admitted.
+    """
+    if not deadline.current().has_time_for(MIN_CALL_BUDGET[priority]):
+        raise deadline.DeadlineExceededError("Not enough time left in the invocation for a Bedrock call")
+
+    circuit_breaker.before_call()
+    try:
+        acquire_token(priority)
+        in_flight_limit.acquire(admission_wait(priority))
+    except AdmissionRejectedError:
+        circuit_breaker.cancel_probe()
+        raise
+    fitted = None
+    try:
+        fitted = bedrock_client(service or client.meta.service_model.service_name, client.meta.region_name, priority)
+        response = getattr(fitted, operation)(**kwargs)
+    except Exception as e:
+        if isinstance(e, ReadTimeoutError) and fitted.meta.config.read_timeout < READ_TIMEOUTS[priority]:
+            # The timeout was cut short by the deadline, which says nothing about Bedrock's health
+            circuit_breaker.cancel_probe()
+            raise deadline.DeadlineExceededError("Bedrock call did not finish within the invocation budget") from e
+        if _is_degraded(e):
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
+        raise
+    finally:
+        in_flight_limit.release()
+    circuit_breaker.record_success()
+    return response
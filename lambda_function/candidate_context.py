@@ -0,0 +1,110 @@
+import json
+import os
+import re
+import time
+
+import records
+from score_aggregation import competency_match_list, parse_percentage
+
+# Seconds a digest is reused without checking for a newer evaluation
+CANDIDATE_CONTEXT_TTL = int(os.getenv("CANDIDATE_CONTEXT_TTL", "300"))
+DIGEST_SUMMARY_CHARS = 600
+DIGEST_AREAS = 3
+DIGEST_IMPROVEMENTS = 5
+DIGEST_FEEDBACK_CHARS = 240
+
+# Questions about the candidate's evaluation results, answered from their stored evaluation
+CANDIDATE_QUESTION_PATTERN = re.compile(
+    r"\b(weak\w*|strength\w*|improv\w*|gaps?|score\w*|match\w*|feedback|evaluat\w*|assess\w*)\b",
+    re.IGNORECASE
+)
+
+# email -> {"evaluated_at", "digest", "checked_at"}
+_digest_cache = {}
+
+
+def is_candidate_question(question):
+    return bool(CANDIDATE_QUESTION_PATTERN.search(question or ''))
+
+
+def load_evaluation(email):
+    """Read only the evaluation attributes of the user's latest summary record"""
+    return records.get_latest_summary(email, ['summary_json', 'evaluated_at', 'matrix_version'])
+
+
+def _truncate(text, limit):
+    text = " ".join(str(text or '').split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+def _ranked(matches):
+    ranked = [(parse_percentage(m.get('match_percentage')), m.get('name'))
+              for m in matches if isinstance(m, dict) and m.get('name')]
+    return sorted(ranked, reverse=True)
+
+
+def build_digest(assessment):
+    """Condense a stored evaluation into a few hundred tokens of prompt context"""
+    lines = []
+    if assessment.get('final_match') is not None:
+        lines.append(f"Overall match: {parse_percentage(assessment['final_match']):g}%")
+    if assessment.get('summary'):
+        lines.append(f"Summary: {_truncate(assessment['summary'], DIGEST_SUMMARY_CHARS)}")
+
+    areas = _ranked(assessment.get('area_matches') or []) or _ranked(
+        competency_match_list(assessment.get('competency_matches')))
+    if areas:
+        count = min(DIGEST_AREAS, max(1, len(areas) // 2))
+        lines.append("Strongest: " + ", ".join(f"{name} ({score:g}%)" for score, name in areas[:count]))
+        weakest = areas[count:][::-1][:count]
+        if weakest:
+            lines.append("Weakest: " + ", ".join(f"{name} ({score:g}%)" for score, name in weakest))
+
+    improvements = assessment.get('areas_of_improvement') or []
+    if isinstance(improvements, dict):
+        improvements = [dict(value, competency=key) if isinstance(value, dict) else {"competency": key, "feedback": value}
+                        for key, value in improvements.items()]
+    if improvements:
+        lines.append("Areas of improvement:")
+        for improvement in improvements[:DIGEST_IMPROVEMENTS]:
+            if isinstance(improvement, dict):
+                name = improvement.get('competency') or improvement.get('name') or 'General'
+                lines.append(f"- {name}: {_truncate(improvement.get('feedback'), DIGEST_FEEDBACK_CHARS)}")
+            else:
+                lines.append(f"- {_truncate(improvement, DIGEST_FEEDBACK_CHARS)}")
+    return "\n".join(lines)
+
+
+def get_candidate_digest(email, evaluated_at=None):
+    """Digest of the user's stored evaluation, or None when there is no usable one
+
+    evaluated_at, when the caller already knows it, lets a cached digest be
+    reused without a read for as long as the evaluation is unchanged.
+    """
+    cached = _digest_cache.get(email)
+    if cached and (cached['evaluated_at'] == evaluated_at if evaluated_at is not None
+                   else time.time() - cached['checked_at'] < CANDIDATE_CONTEXT_TTL):
+        return cached['digest']
+
+    try:
+        item = load_evaluation(email)
+    except Exception as e:
+        print(f"Error loading stored evaluation for {email}: {str(e)}")
+        return None
+    if not item or not item.get('summary_json'):
+        return None
+
+    try:
+        assessment = json.loads(item['summary_json'])
+    except (TypeError, ValueError):
+        print(f"Stored evaluation for {email} is not JSON, not using it as context")
+        return None
+    digest = build_digest(assessment) if isinstance(assessment, dict) else ''
+    digest = digest or None
+
+    _digest_cache[email] = {
+        'evaluated_at': item.get('evaluated_at'),
+        'digest': digest,
+        'checked_at': time.time()
+    }
+    return digest
@@ -0,0 +1,168 @@
+import functools
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+
+import deadline
+import records
+
+CHAT_PERSISTENCE_MODE = os.getenv("CHAT_PERSISTENCE_MODE", "write_behind")
+CHAT_PERSIST_QUEUE_URL = os.getenv("CHAT_PERSIST_QUEUE_URL")
+FLUSH_ATTEMPTS = 3
+
+EXTENSION_NAME = "chat-write-behind"
+RUNTIME_API = os.getenv("AWS_LAMBDA_RUNTIME_API")
+
+_buffer = queue.Queue()
+_invocation_done = threading.Event()
+_extension_running = False
+
+
+def build_chat_record(user_email, question, answer, context=None):
+    return {
+        'email': user_email,
+        'question': question,
+        'answer': answer,
+        'timestamp': int(time.time() * 1000),
+        'context': context or {}
+    }
+
+
+def store_chat_record(record):
+    """Write one interaction as its own CHAT record"""
+    return records.put_chat(record)
+
+
+def write_chat_records(chat_records):
+    """Write interactions with BatchWriteItem; every interaction is kept as a CHAT record"""
+    if not chat_records:
+        return 0
+    return records.put_chats(chat_records)
+
+
+def flush(chat_records=None):
+    """Flush buffered (or given) records, retrying with backoff
+
+    Records that still fail are sent to the persistence queue when one is
+    configured, and otherwise logged in full so they can be replayed.
+    """
+    if chat_records is None:
+        chat_records = []
+        while not _buffer.empty():
+            chat_records.append(_buffer.get_nowait())
+    if not chat_records:
+        return
+
+    for attempt in range(1, FLUSH_ATTEMPTS + 1):
+        try:
+            written = write_chat_records(chat_records)
+            print(f"Flushed {written} chat records")
+            return
+        except Exception as e:
+            print(f"Chat flush attempt {attempt}/{FLUSH_ATTEMPTS} failed: {str(e)}")
+            if attempt < FLUSH_ATTEMPTS:
+                time.sleep(0.2 * 2 ** attempt)
+
+    if CHAT_PERSIST_QUEUE_URL:
+        try:
+            enqueue(chat_records)
+            return
+        except Exception as e:
+            print(f"Failed to queue unflushed chat records: {str(e)}")
+    print(f"Dropping unflushed chat records: {json.dumps(chat_records, default=str)}")
+
+
+def enqueue(chat_records):
+    sqs = deadline.client('sqs', 5)
+    for start in range(0, len(chat_records), 10):
+        sqs.send_message_batch(
+            QueueUrl=CHAT_PERSIST_QUEUE_URL,
+            Entries=[
+                {'Id': str(index), 'MessageBody': json.dumps(record, default=str)}
+                for index, record in enumerate(chat_records[start:start + 10])
+            ]
+        )
+
+
+def persist(record):
+    """Store an interaction according to CHAT_PERSISTENCE_MODE without ever raising"""
+    try:
+        if CHAT_PERSISTENCE_MODE == "write_behind":
+            _buffer.put(record)
+        elif CHAT_PERSISTENCE_MODE == "queue" and CHAT_PERSIST_QUEUE_URL:
+            enqueue([record])
+        else:
+            store_chat_record(record)
+            print("Successfully stored chat interaction")
+    except Exception as e:
+        print(f"Error storing chat interaction: {str(e)}")
+
+
+def _extension_request(path, method='GET', headers=None, body=None):
+    request = urllib.request.Request(
+        f"http://{RUNTIME_API}/2020-01-01/extension/{path}",
+        data=body,
+        headers=headers or {},
+        method=method
+    )
+    return urllib.request.urlopen(request)
+
+
+def _run_extension(extension_id):
+    """Flush after each invocation; Lambda freezes the container only once this loop asks for the next event"""
+    while True:
+        with _extension_request('event/next', headers={'Lambda-Extension-Identifier': extension_id}) as response:
+            event = json.loads(response.read())
+        if event.get('eventType') == 'SHUTDOWN':
+            flush()
+            return
+        # The INVOKE event arrives as the handler starts; wait for it to return before flushing
+        _invocation_done.wait(max(1.0, (event.get('deadlineMs', 0) / 1000) - time.time()))
+        _invocation_done.clear()
+        try:
+            flush()
+        except Exception as e:
+            print(f"Error flushing chat records: {str(e)}")
+
+
+def _start_extension():
+    """Register the post-response flusher as an internal extension; only possible during container init"""
+    global _extension_running
+    if _extension_running or not RUNTIME_API or CHAT_PERSISTENCE_MODE != "write_behind":
+        return
+    try:
+        with _extension_request(
+            'register',
+            method='POST',
+            headers={'Lambda-Extension-Name': EXTENSION_NAME},
+            body=json.dumps({'events': ['INVOKE']}).encode('utf-8')
+        ) as response:
+            extension_id = response.headers['Lambda-Extension-Identifier']
+        threading.Thread(target=_run_extension, args=(extension_id,), daemon=True).start()
+        _extension_running = True
+    except Exception as e:
+        print(f"Write-behind extension unavailable, flushing inline: {str(e)}")
+
+
+def write_behind(handler):
+    """Decorate a Lambda handler so buffered chat records are flushed once it has returned
+
+    Decoration runs when the handler's module is imported, during container
+    init, which is when Lambda accepts extension registrations. Functions
+    that only import this module, like the queue consumer, register nothing.
+    """
+    _start_extension()
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        try:
+            return handler(event, context)
+        finally:
+            if _extension_running:
+                _invocation_done.set()
+            else:
+                flush()
+    return wrapper
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+# Seconds kept in reserve to write status and hand off before Lambda kills the invocation
+DEADLINE_SAFETY_MARGIN = float(os.getenv("DEADLINE_SAFETY_MARGIN", "10"))
+# Budget assumed when no Lambda context is available, e.g. local runs
+DEFAULT_BUDGET_SECONDS = 900
+MAX_HANDOFFS = int(os.getenv("MAX_HANDOFFS", "3"))
+
+MIN_CALL_SECONDS = 1.0
+CALL_ATTEMPTS = 2
+TIMEOUT_STEPS = (1, 2, 3, 5, 10, 20, 30, 45, 60, 90, 120, 180, 240, 300, 450, 600, 900)
+
+# (kind, service, timeout step, client kwargs) -> boto3 client or resource
+_clients = {}
+# boto3 sessions are not thread-safe, so clients are created from a dedicated session under a lock
+_session = None
+_clients_lock = threading.Lock()
+
+
+class DeadlineExceededError(Exception):
+    """Raised instead of starting work that cannot finish within the invocation"""
+
+
+class Deadline:
+    """Remaining time budget of the current invocation, minus a safety margin"""
+
+    def __init__(self, remaining_seconds, safety_margin=DEADLINE_SAFETY_MARGIN):
+        self.expires_at = time.monotonic() + remaining_seconds - safety_margin
+
+    @classmethod
+    def from_context(cls, context):
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            return cls(context.get_remaining_time_in_millis() / 1000)
+        return cls(DEFAULT_BUDGET_SECONDS)
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def has_time_for(self, seconds):
+        return self.remaining() >= seconds
+
+    def timeout(self, cap, operation="call"):
+        """Timeout for one call: the remaining budget, capped at cap seconds"""
+        timeout = min(cap, self.remaining())
+        if timeout < MIN_CALL_SECONDS:
+            raise DeadlineExceededError(f"Not enough time left in the invocation for {operation}")
+        return timeout
+
+
+_current = Deadline(DEFAULT_BUDGET_SECONDS, safety_margin=0)
+
+
+def start(context):
+    """Set the deadline of the current invocation from the Lambda context"""
+    global _current
+    _current = Deadline.from_context(context)
+    print(f"Invocation budget: {_current.remaining():.1f}s after safety margin")
+    return _current
+
+
+def current():
+    return _current
+
+
+def timeout_step(seconds):
+    """Largest standard timeout not above seconds, so clients can be reused across calls"""
+    step = TIMEOUT_STEPS[0]
+    for candidate in TIMEOUT_STEPS:
+        if candidate <= seconds:
+            step = candidate
+    return step
+
+
+def _create(kind, service, **kwargs):
+    """Create a client or resource from the dedicated session; the caller holds _clients_lock"""
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+    return getattr(_session, kind)(service, **kwargs)
+
+
+def create_client(service, **kwargs):
+    """boto3 client with a config of the caller's own, created safely from any thread"""
+    with _clients_lock:
+        return _create('client', service, **kwargs)
+
+
+def _cached(kind, service, cap, **kwargs):
+    # Retries share the budget, so each attempt gets an equal slice of it
+    per_attempt = current().timeout(cap, service) / CALL_ATTEMPTS
+    timeout = timeout_step(per_attempt)
+    cache_key = (kind, service, timeout, tuple(sorted(kwargs.items())))
+    instance = _clients.get(cache_key)
+    if instance is None:
+        with _clients_lock:
+            instance = _clients.get(cache_key)
+            if instance is None:
+                config = Config(
+                    connect_timeout=min(5, timeout),
+                    read_timeout=timeout,
+                    retries={'mode': 'standard', 'max_attempts': CALL_ATTEMPTS}
+                )
+                instance = _create(kind, service, config=config, **kwargs)
+                _clients[cache_key] = instance
+    return instance
+
+
+def client(service, cap=60, **kwargs):
+    """boto3 client whose timeouts fit the remaining budget, capped at cap seconds"""
+    return _cached('client', service, cap, **kwargs)
+
+
+def resource(service, cap=60, **kwargs):
+    """boto3 resource whose timeouts fit the remaining budget, capped at cap seconds"""
+    return _cached('resource', service, cap, **kwargs)
+
+
+def hand_off(context, event, function_name=None):
+    """Re-invoke this function asynchronously to continue work past the current deadline"""
+    handoffs = int(event.get('handoffs', 0)) + 1
+    if handoffs > MAX_HANDOFFS:
+        raise DeadlineExceededError(f"Giving up after {MAX_HANDOFFS} hand-offs")
+
+    function_name = function_name or getattr(context, 'function_name', None)
+    if not function_name:
+        raise DeadlineExceededError("Cannot hand off without a function name")
+
+    payload = dict(event, handoffs=handoffs)
+    client('lambda', 10).invoke(
+        FunctionName=function_name,
+        InvocationType='Event',
+        Payload=json.dumps(payload)
+    )
+    print(f"Handed off to {function_name} (hand-off {handoffs}/{MAX_HANDOFFS})")
+    return handoffs
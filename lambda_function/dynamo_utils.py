@@ -0,0 +1,10 @@
+import deadline
+
+
+def batch_put_items(table_name, items, key_names):
+    """Write items with BatchWriteItem; the batch writer resends unprocessed items"""
+    table = deadline.resource('dynamodb', 30).Table(table_name)
+    with table.batch_writer(overwrite_by_pkeys=key_names) as writer:
+        for item in items:
+            writer.put_item(Item=item)
+    return len(items)
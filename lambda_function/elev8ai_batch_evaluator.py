@@ -0,0 +1,183 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import deadline
+import records
+from bedrock_admission import PRIORITY_BACKGROUND, AdmissionRejectedError, bedrock_client
+from dynamo_utils import batch_put_items
+from evaluation import EvaluationCheckpoint, evaluate_candidate
+from http_response import error_response, success_response
+from matrix_utils import get_matrix_projection, get_matrix_shards, load_matrix
+from prompt_templates import get_template
+from score_aggregation import get_matrix_index
+
+BATCH_MAX_PARALLELISM = int(os.getenv("BATCH_MAX_PARALLELISM", "5"))
+# Candidates are not started with less invocation time left than this; they are handed off instead
+BATCH_MIN_EVALUATION_SECONDS = float(os.getenv("BATCH_MIN_EVALUATION_SECONDS", "120"))
+# Completed evaluations are stored in batches of this size as they finish, so a hand-off keeps them
+BATCH_STORE_SIZE = int(os.getenv("BATCH_STORE_SIZE", "5"))
+
+
+def prepare_matrix(candidates, shard_by):
+    """Fetch the matrix once and warm the projections and index every candidate needs"""
+    matrix_json, matrix_version = load_matrix()
+    get_template("evaluator")
+    get_matrix_index(matrix_json, matrix_version)
+    for designations in {(c.get('from_designation'), c.get('to_designation')) for c in candidates}:
+        if shard_by:
+            get_matrix_shards(matrix_json, matrix_version, *designations, shard_by)
+        else:
+            get_matrix_projection(matrix_json, matrix_version, *designations)
+    return matrix_json, matrix_version
+
+
+def evaluate_one(client, candidate, matrix, shard_by, knowledge_base_id, model_arn):
+    """Evaluate a single candidate, capturing failures as a per-candidate status"""
+    started_at = time.time()
+    email = candidate.get('email')
+    if not deadline.current().has_time_for(BATCH_MIN_EVALUATION_SECONDS):
+        return {"email": email, "status": "DEFERRED"}, None, None
+    try:
+        assessment_result, details = evaluate_candidate(
+            client=client,
+            candidate_email=email,
+            from_designation=candidate.get('from_designation'),
+            to_designation=candidate.get('to_designation'),
+            knowledge_base_id=knowledge_base_id,
+            model_arn=model_arn,
+            shard_by=shard_by,
+            matrix=matrix,
+            artifact_hash=candidate.get('artifact_hash')
+        )
+        status = {"email": email, "status": "COMPLETED", "final_match": assessment_result.get("final_match")}
+        return status, assessment_result, details
+    except (EvaluationCheckpoint, deadline.DeadlineExceededError, AdmissionRejectedError) as e:
+        # Candidates that could not get Bedrock capacity before the deadline are handed off, not failed
+        print(f"Deferring {email}: {str(e)}")
+        return {"email": email, "status": "DEFERRED"}, None, None
+    except Exception as e:
+        print(f"Evaluation failed for {email}: {str(e)}")
+        return {"email": email, "status": "FAILED", "error": str(e)}, None, None
+    finally:
+        print(f"Evaluated {email} in {time.time() - started_at:.1f}s")
+
+
+def store_results(evaluated):
+    """Write evaluations as new summary records with BatchWriteItem, then point each STATUS record at them
+
+    Summary records are items of their own, so nothing needs to be read and
+    merged first.
+    """
+    if not evaluated:
+        return 0
+    evaluated_at = int(time.time() * 1000)
+    items = [
+        records.summary_item(
+            email,
+            json.dumps(assessment_result),
+            details['prompt_version'],
+            details['matrix_version'],
+            evaluated_at,
+            details['from_designation'],
+            details['to_designation']
+        )
+        for email, (assessment_result, details) in evaluated.items()
+    ]
+    stored = batch_put_items(records.RECORDS_TABLE, items, records.KEY_NAMES)
+    for email in evaluated:
+        records.update_status(
+            email,
+            {'evaluation_status': 'COMPLETED', 'evaluated_at': evaluated_at},
+            remove=('evaluation_checkpoint', 'evaluation_error')
+        )
+    return stored
+
+
+def store_completed(evaluated, statuses):
+    """Store a batch of completed evaluations, marking their statuses STORE_FAILED if the write fails"""
+    try:
+        store_results(evaluated)
+    except Exception as e:
+        print(f"Error storing batch results: {str(e)}")
+        for email in evaluated:
+            statuses[email].update(status="STORE_FAILED", error=str(e))
+
+
+def lambda_handler(event, context):
+    deadline.start(context)
+    AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+    KNOWLEDGE_BASE_ID = os.getenv("KNOWLEDGE_BASE_ID")
+    MODEL_ARN = os.getenv("MODEL_ARN")
+
+    print("event::::", json.dumps(event))
+
+    try:
+        candidates = event.get('candidates') or []
+        if not isinstance(candidates, list) or not candidates:
+            return error_response(event, 400, "candidates must be a non-empty list")
+        if not all(isinstance(c, dict) and c.get('email') for c in candidates):
+            return error_response(event, 400, "Every candidate requires an email")
+
+        # Later records for the same email replace earlier ones
+        candidates = list({c['email']: c for c in candidates}.values())
+        max_parallelism = max(1, int(event.get('max_parallelism') or BATCH_MAX_PARALLELISM))
+        shard_by = event.get('shard_by')
+
+        started_at = time.time()
+        matrix = prepare_matrix(candidates, shard_by)
+
+        client = bedrock_client("bedrock-agent-runtime", AWS_REGION, PRIORITY_BACKGROUND)
+
+        statuses = {}
+        evaluated = {}
+        with ThreadPoolExecutor(max_workers=min(max_parallelism, len(candidates))) as executor:
+            futures = [
+                executor.submit(evaluate_one, client, candidate, matrix, shard_by, KNOWLEDGE_BASE_ID, MODEL_ARN)
+                for candidate in candidates
+            ]
+            for future in as_completed(futures):
+                status, assessment_result, details = future.result()
+                statuses[status['email']] = status
+                if details is not None:
+                    evaluated[status['email']] = (assessment_result, details)
+                if len(evaluated) >= BATCH_STORE_SIZE:
+                    store_completed(evaluated, statuses)
+                    evaluated = {}
+        store_completed(evaluated, statuses)
+        results = [statuses[c['email']] for c in candidates]
+
+        # Candidates the deadline did not leave room for continue in a fresh invocation
+        deferred = [status['email'] for status in results if status['status'] == "DEFERRED"]
+        if deferred:
+            deferred_candidates = [c for c in candidates if c['email'] in set(deferred)]
+            try:
+                deadline.hand_off(context, dict(event, candidates=deferred_candidates))
+            except Exception as e:
+                print(f"Hand-off of {len(deferred)} deferred candidates failed: {str(e)}")
+                for status in results:
+                    if status['status'] == "DEFERRED":
+                        status.update(status="FAILED", error=f"Not evaluated before the deadline: {str(e)}")
+
+        elapsed = time.time() - started_at
+        succeeded = sum(1 for status in results if status['status'] == "COMPLETED")
+        stats = {
+            "total": len(results),
+            "succeeded": succeeded,
+            "deferred": sum(1 for status in results if status['status'] == "DEFERRED"),
+            "failed": sum(1 for status in results if status['status'] not in ("COMPLETED", "DEFERRED")),
+            "max_parallelism": max_parallelism,
+            "matrix_version": matrix[1],
+            "elapsed_seconds": round(elapsed, 2),
+            "candidates_per_minute": round(len(results) * 60 / elapsed, 2) if elapsed else None
+        }
+        print(f"Batch stats: {json.dumps(stats)}")
+        return success_response(event, {"results": results, "stats": stats})
+
+    except Exception as e:
+        import traceback
+        print(f"Error: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return error_response(event, 500, str(e))
+
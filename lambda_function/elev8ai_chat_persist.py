@@ -0,0 +1,31 @@
+import json
+
+import deadline
+from chat_persistence import write_chat_records
+
+
+def lambda_handler(event, context):
+    """Consume chat records queued by the chatbot and write them in one batch
+
+    Returns the SQS partial batch response, so only failed messages are
+    redelivered and the queue's redrive policy keeps records that keep failing.
+    """
+    deadline.start(context)
+    records = []
+    message_ids = []
+    failures = []
+    for message in event.get('Records', []):
+        try:
+            records.append(json.loads(message['body']))
+            message_ids.append(message['messageId'])
+        except (KeyError, ValueError) as e:
+            print(f"Skipping malformed chat record {message.get('messageId')}: {str(e)}")
+
+    print(f"Persisting {len(records)} chat records")
+    try:
+        write_chat_records(records)
+    except Exception as e:
+        print(f"Error persisting chat records: {str(e)}")
+        failures = [{"itemIdentifier": message_id} for message_id in message_ids]
+
+    return {"batchItemFailures": failures}
@@ -1,58 +1,34 @@
 import base64
 import json
 import os
+import time
 from datetime import datetime
 
-import boto3
-from botocore.config import Config
 from botocore.exceptions import ClientError
 
-# Initialize clients with proper configuration
-s3 = boto3.client('s3', region_name='us-east-1')
-dynamodb = boto3.resource('dynamodb')
-
-S3_BUCKET = "elev8ai"
-MATRIX_FILE = "competency_matrix.json"
-DYNAMODB_TABLE = "Elev8-ai-summary"
-
-bedrock_config = Config(
-    connect_timeout=900,
-    read_timeout=900
+import answer_cache
+import candidate_context
+import deadline
+import records
+from bedrock_admission import PRIORITY_INTERACTIVE, bedrock_client, call_bedrock
+from chat_persistence import build_chat_record, persist, write_behind
+from http_response import error_response, is_preflight, preflight_response, success_response
+from matrix_utils import load_matrix
+from retrieval_cache import RETRIEVAL_MODE, candidate_chunks, generate_from_chunks, rank_chunks, retrieve_chunks
+from retrieval_policy import (
+    QUERY_PERSONAL, choose_retrieval, classify_question, is_matrix_question, record_retrieval,
+    vector_search_configuration
 )
 
-
-def get_matrix_from_s3(bucket, key):
-    try:
-        print(f"Attempting to fetch matrix from S3: {bucket}/{key}")
-        response = s3.get_object(Bucket=bucket, Key=key)
-        matrix_data = json.loads(response['Body'].read().decode('utf-8'))
-        print("Successfully retrieved matrix from S3")
-        return matrix_data
-    except ClientError as e:
-        error_msg = f"S3 ClientError retrieving matrix: {str(e)}"
-        print(error_msg)
-        raise Exception(error_msg)
-    except json.JSONDecodeError as e:
-        error_msg = f"JSON decode error in matrix file: {str(e)}"
-        print(error_msg)
-        raise Exception(error_msg)
-    except Exception as e:
-        error_msg = f"Unexpected error getting matrix: {str(e)}"
-        print(error_msg)
-        raise Exception(error_msg)
+CHAT_MAX_TOKENS = 1024
+ALLOWED_METHODS = "GET,POST,OPTIONS"
 
 
 def get_chat_history(user_email, limit=5):
     try:
         print(f"Fetching chat history for: {user_email}")
-        table = dynamodb.Table(DYNAMODB_TABLE)
-        response = table.query(
-            KeyConditionExpression='email = :email',
-            ExpressionAttributeValues={':email': user_email},
-            Limit=limit,
-            ScanIndexForward=False
-        )
-        items = response.get('Items', [])
+        # Only the latest CHAT records are read; the stored evaluation is read separately when needed
+        items = records.get_chat_history(user_email, limit, ['question', 'answer', 'timestamp'])
         print(f"Found {len(items)} chat history items")
         return items
     except ClientError as e:
@@ -65,45 +41,11 @@ def get_chat_history(user_email, limit=5):
         return []
 
 
-def store_chat_interaction(user_email, question, answer, context=None):
-    try:
-        print(f"Storing chat interaction for: {user_email}")
-        table = dynamodb.Table(DYNAMODB_TABLE)
-        timestamp = int(datetime.now().timestamp() * 1000)
-
-        response = table.update_item(
-            Key={'email': user_email},
-            UpdateExpression="SET #q = :question, #a = :answer, #ts = :timestamp, #ctx = :context",
-            ExpressionAttributeNames={
-                '#q': 'question',
-                '#a': 'answer',
-                '#ts': 'timestamp',
-                '#ctx': 'context'
-            },
-            ExpressionAttributeValues={
-                ':question': question,
-                ':answer': answer,
-                ':timestamp': timestamp,
-                ':context': context or {}
-            },
-            ReturnValues="UPDATED_NEW"
-        )
-        print("Successfully stored chat interaction")
-        return response
-    except ClientError as e:
-        error_msg = f"DynamoDB ClientError storing chat: {str(e)}"
-        print(error_msg)
-        raise Exception(error_msg)
-    except Exception as e:
-        error_msg = f"Unexpected error storing chat: {str(e)}"
-        print(error_msg)
-        raise Exception(error_msg)
-
-
-def build_chat_context(user_email, current_question):
+def build_chat_context(user_email, current_question, chat_history=None):
     try:
         print(f"Building chat context for: {user_email}")
-        chat_history = get_chat_history(user_email)
+        if chat_history is None:
+            chat_history = get_chat_history(user_email)
         if not chat_history:
             print("No chat history found")
             return f"Current question: {current_question}"
@@ -124,9 +66,15 @@ def build_chat_context(user_email, current_question):
         return f"Current question: {current_question}"
 
 
-def generate_chat_response(client, prompt, context, matrix, knowledge_base_id, model_arn, user_email):
+def generate_chat_response(client, prompt, context, matrix, knowledge_base_id, model_arn, user_email,
+                           candidate_digest=None, retrieval=None, artifact_hash=None):
     try:
         print(f"Generating response for: {user_email}")
+        retrieval = retrieval or choose_retrieval(prompt, user_email, has_digest=bool(candidate_digest))
+
+        # The candidate's own evaluation answers questions about them better than a matrix slice;
+        # questions that are also about the matrix get the digest next to the matrix
+        include_matrix = not candidate_digest or is_matrix_question(prompt)
 
         # Truncate the matrix content if needed (keep last part which is often most relevant)
         max_matrix_length = 5000  # Leave room for other components
@@ -145,8 +93,12 @@ def generate_chat_response(client, prompt, context, matrix, knowledge_base_id, m
             f"User Email: {user_email}",
             "Chat Context (recent conversation history):",
             context[:max_context_length],
-            "\nCompetency Matrix Context (most relevant parts):",
-            matrix[:max_matrix_length],
+        ]
+        if include_matrix:
+            prompt_parts += ["\nCompetency Matrix Context (most relevant parts):", matrix[:max_matrix_length]]
+        if candidate_digest:
+            prompt_parts += ["\nCandidate Evaluation (stored assessment digest):", candidate_digest[:max_matrix_length]]
+        prompt_parts += [
             "\nCurrent Question:",
             prompt,
             "\nInstructions:",
@@ -164,26 +116,52 @@ def generate_chat_response(client, prompt, context, matrix, knowledge_base_id, m
             print(f"Prompt too long ({len(full_prompt)}), truncating further")
             full_prompt = full_prompt[:19000] + "\n[CONTENT TRUNCATED]"
 
-        print(f"Sending prompt of length {len(full_prompt)} to Bedrock")
-
-        response = client.retrieve_and_generate(
-            input={"text": full_prompt},
-            retrieveAndGenerateConfiguration={
-                "knowledgeBaseConfiguration": {
-                    "knowledgeBaseId": knowledge_base_id,
-                    "modelArn": model_arn,
-                    "retrievalConfiguration": {
-                        "vectorSearchConfiguration": {
-                            "numberOfResults": 50,  # Reduced from 100 to limit response size
-                            "overrideSearchType": "HYBRID"
+        print(f"Sending prompt of length {len(full_prompt)} to Bedrock "
+              f"({retrieval['query_class']} question, {retrieval['number_of_results']} results)")
+        started_at = time.time()
+
+        retrieval_cached = None
+        if RETRIEVAL_MODE == "split":
+            if retrieval["query_class"] == QUERY_PERSONAL and retrieval["user_email"]:
+                # Personal questions share the evaluator's cached retrieval of the user's artifacts, ranked locally
+                chunks, retrieval_cached = candidate_chunks(
+                    client, knowledge_base_id, retrieval["user_email"], artifact_hash, PRIORITY_INTERACTIVE
+                )
+                chunks = rank_chunks(prompt, chunks, retrieval["number_of_results"])
+            else:
+                chunks, retrieval_cached = retrieve_chunks(
+                    client, knowledge_base_id, retrieval["query"], retrieval, vector_search_configuration(retrieval),
+                    artifact_hash=artifact_hash, priority=PRIORITY_INTERACTIVE
+                )
+            retrieved_chunks = len(chunks)
+            output = generate_from_chunks(
+                client, model_arn, full_prompt, chunks, PRIORITY_INTERACTIVE, max_tokens=CHAT_MAX_TOKENS
+            )
+        else:
+            response = call_bedrock(
+                client,
+                "retrieve_and_generate",
+                PRIORITY_INTERACTIVE,
+                input={"text": full_prompt},
+                retrieveAndGenerateConfiguration={
+                    "knowledgeBaseConfiguration": {
+                        "knowledgeBaseId": knowledge_base_id,
+                        "modelArn": model_arn,
+                        "retrievalConfiguration": {
+                            "vectorSearchConfiguration": vector_search_configuration(retrieval)
                         }
-                    }
-                },
-                "type": "KNOWLEDGE_BASE"
-            }
-        )
-
-        output = response["output"]["text"].strip()
+                    },
+                    "type": "KNOWLEDGE_BASE"
+                }
+            )
+            output = response["output"]["text"].strip()
+            # Managed mode reports the chunks it used only as citation references
+            retrieved_chunks = sum(
+                len(citation.get("retrievedReferences", [])) for citation in response.get("citations", [])
+            )
+
+        record_retrieval(retrieval, retrieved_chunks, (time.time() - started_at) * 1000, len(full_prompt),
+                         bool(candidate_digest), retrieval_cached)
         print("Successfully generated response")
         return output
 
@@ -199,27 +177,16 @@ def generate_chat_response(client, prompt, context, matrix, knowledge_base_id, m
         raise Exception(error_msg)
 
 
+@write_behind
 def lambda_handler(event, context):
-    if event.get('httpMethod') == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
-                'Access-Control-Allow-Methods': 'GET,POST,OPTIONS',
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({})
-        }
+    if is_preflight(event):
+        return preflight_response(ALLOWED_METHODS)
+    deadline.start(context)
     AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
     KNOWLEDGE_BASE_ID = os.getenv("KNOWLEDGE_BASE_ID")
     MODEL_ARN = os.getenv("MODEL_ARN")
 
-    client = boto3.client(
-        "bedrock-agent-runtime",
-        region_name=AWS_REGION,
-        config=bedrock_config
-    )
+    client = bedrock_client("bedrock-agent-runtime", AWS_REGION, PRIORITY_INTERACTIVE)
 
     print("Received event:", json.dumps(event))
 
@@ -245,68 +212,65 @@ def lambda_handler(event, context):
         print(f"Processing request for {candidate_email}: {user_input}")
 
         # Get competency matrix
-        matrix_json = get_matrix_from_s3(S3_BUCKET, MATRIX_FILE)
+        matrix_json, matrix_version = load_matrix()
         matrix = json.dumps(matrix_json, ensure_ascii=False)
 
         # Build chat context
-        chat_context = build_chat_context(candidate_email, user_input)
-
-        # Generate response
-        response_text = generate_chat_response(
-            client=client,
-            prompt=user_input,
-            context=chat_context,
-            matrix=matrix,
-            knowledge_base_id=KNOWLEDGE_BASE_ID,
-            model_arn=MODEL_ARN,
-            user_email=candidate_email  # Passing the email to the function
+        chat_history = get_chat_history(candidate_email)
+        chat_context = build_chat_context(candidate_email, user_input, chat_history)
+
+        # Answers stay valid until the user's artifact, the matrix or their evaluation changes
+        try:
+            user_item = records.get_status(candidate_email, ['artifact_hash', 'evaluated_at']) or {}
+        except Exception as e:
+            print(f"Error reading user status: {str(e)}")
+            user_item = {}
+        cache_scope = answer_cache.cache_scope(
+            user_item.get('artifact_hash'), matrix_version, user_item.get('evaluated_at')
         )
+        response_text = answer_cache.lookup(candidate_email, user_input, cache_scope)
 
-        # Store the interaction
-        store_chat_interaction(
+        # Generate response
+        if response_text is None:
+            candidate_digest = None
+            if classify_question(user_input) == QUERY_PERSONAL:
+                candidate_digest = candidate_context.get_candidate_digest(
+                    candidate_email, user_item.get('evaluated_at')
+                )
+            retrieval = choose_retrieval(user_input, candidate_email, has_digest=bool(candidate_digest))
+            response_text = generate_chat_response(
+                client=client,
+                prompt=user_input,
+                context=chat_context,
+                matrix=matrix,
+                knowledge_base_id=KNOWLEDGE_BASE_ID,
+                model_arn=MODEL_ARN,
+                user_email=candidate_email,  # Passing the email to the function
+                candidate_digest=candidate_digest,
+                retrieval=retrieval,
+                artifact_hash=user_item.get('artifact_hash')
+            )
+            answer_cache.store(candidate_email, user_input, cache_scope, response_text)
+
+        # Store the interaction after the answer is returned (see chat_persistence)
+        persist(build_chat_record(
             user_email=candidate_email,
             question=user_input,
             answer=response_text,
             context={"generated_at": datetime.now().isoformat()}
-        )
+        ))
 
         # Return the response
-        return success_response({
+        return success_response(event, {
             "answer": response_text,
             "context": chat_context
-        })
+        }, ALLOWED_METHODS)
 
     # except ValueError as e:
     #     error_msg = f"Input validation error: {str(e)}"
     #     print(error_msg)
-    #     return error_response(400, error_msg)
+    #     return error_response(event, 400, error_msg, ALLOWED_METHODS)
     except Exception as e:
         error_msg = f"Processing error: {str(e)}"
         print(error_msg)
-        return error_response(500, error_msg)
-
-
-def success_response(data):
-    return {
-        "statusCode": 200,
-        "body": json.dumps({"response": data}),
-        "headers": {
-            "Access-Control-Allow-Origin": "*",  # Or your specific domain
-            "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-            "Access-Control-Allow-Methods": "POST,GET,OPTIONS",
-            "Content-Type": "application/json"
-        },
-    }
-
-
-def error_response(code, message):
-    return {
-        "statusCode": code,
-        "body": json.dumps({"error": "message"}),
-        "headers": {
-            "Access-Control-Allow-Origin": "*",  # Or your specific domain
-            "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-            "Access-Control-Allow-Methods": "POST,GET,OPTIONS",
-            "Content-Type": "application/json"
-        },
-    }
+        return error_response(event, 500, error_msg, ALLOWED_METHODS)
@@ -0,0 +1,176 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import deadline
+import records
+from artifact_uploads import read_metadata
+from bedrock_admission import PRIORITY_BACKGROUND, AdmissionRejectedError, bedrock_client
+from evaluation import rescore_competencies
+from http_response import error_response, success_response
+from matrix_utils import evaluation_levels, load_matrix
+from matrix_versions import diff_matrices, load_snapshot, save_snapshot
+
+REEVALUATION_MAX_PARALLELISM = int(os.getenv("REEVALUATION_MAX_PARALLELISM", "5"))
+# Candidates are not started with less invocation time left than this; they are handed off instead
+REEVALUATION_MIN_SECONDS = float(os.getenv("REEVALUATION_MIN_SECONDS", "60"))
+# Evaluations without a stored matrix snapshot are evaluated afresh by this function
+BATCH_EVALUATOR_FUNCTION_NAME = os.getenv("BATCH_EVALUATOR_FUNCTION_NAME", "Elev8AI-BatchEvaluator")
+
+
+def reevaluate_one(client, email, matrix, knowledge_base_id, model_arn):
+    """Bring one candidate's latest evaluation to the current matrix version, capturing the outcome as a status"""
+    started_at = time.time()
+    matrix_json, matrix_version = matrix
+    if not deadline.current().has_time_for(REEVALUATION_MIN_SECONDS):
+        return {"email": email, "status": "DEFERRED"}
+    try:
+        summary = records.get_latest_summary(email)
+        if summary is None:
+            return {"email": email, "status": "NOT_EVALUATED"}
+        if summary.get('matrix_version') == matrix_version:
+            return {"email": email, "status": "UP_TO_DATE"}
+        from_designation = summary.get('from_designation')
+        to_designation = summary.get('to_designation')
+        artifact_hash = (records.get_status(email, ['artifact_hash']) or {}).get('artifact_hash')
+
+        # Without the matrix the evaluation used there is nothing to diff against, so it is evaluated afresh
+        old_matrix = load_snapshot(summary['matrix_version']) if summary.get('matrix_version') else None
+        if old_matrix is None:
+            if not (from_designation and to_designation):
+                # Evaluations stored before designations were recorded take them from the artifact
+                metadata = read_metadata(email)
+                from_designation = from_designation or metadata.get('from_designation')
+                to_designation = to_designation or metadata.get('to_designation')
+            status = {"email": email, "status": "NO_SNAPSHOT", "matrix_version": summary.get('matrix_version')}
+            if from_designation and to_designation:
+                status["candidate"] = {"email": email, "from_designation": from_designation,
+                                       "to_designation": to_designation, "artifact_hash": artifact_hash}
+            else:
+                status["error"] = "No designations to evaluate afresh with"
+            return status
+
+        diff = diff_matrices(
+            old_matrix, summary['matrix_version'], matrix_json, matrix_version,
+            evaluation_levels(from_designation, to_designation)
+        )
+        assessment_result, details = rescore_competencies(
+            client, email, json.loads(summary['summary_json']), diff, matrix, from_designation, to_designation,
+            knowledge_base_id, model_arn, artifact_hash
+        )
+
+        stored = records.put_summary(
+            email,
+            json.dumps(assessment_result),
+            details['prompt_version'],
+            details['matrix_version'],
+            from_designation=from_designation,
+            to_designation=to_designation
+        )
+        records.update_status(email, {'evaluated_at': stored['evaluated_at']})
+        return {
+            "email": email,
+            "status": "COMPLETED",
+            "rescored": len(diff["changed"]) + len(diff["added"]),
+            "removed": len(diff["removed"]),
+            "final_match": assessment_result.get("final_match")
+        }
+    except (deadline.DeadlineExceededError, AdmissionRejectedError) as e:
+        # Candidates that could not get Bedrock capacity before the deadline are handed off, not failed
+        print(f"Deferring {email}: {str(e)}")
+        return {"email": email, "status": "DEFERRED"}
+    except Exception as e:
+        print(f"Re-evaluation failed for {email}: {str(e)}")
+        return {"email": email, "status": "FAILED", "error": str(e)}
+    finally:
+        print(f"Re-evaluated {email} in {time.time() - started_at:.1f}s")
+
+
+def lambda_handler(event, context):
+    """Re-score stored evaluations against the current competency matrix
+
+    Runs on the matrix's S3 object-created event or on demand with
+    {"emails": [...], "max_parallelism": 5}; without emails, every user is
+    checked. Only competencies whose definition changed since the matrix
+    version an evaluation used are scored again.
+    """
+    deadline.start(context)
+    AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+    KNOWLEDGE_BASE_ID = os.getenv("KNOWLEDGE_BASE_ID")
+    MODEL_ARN = os.getenv("MODEL_ARN")
+
+    print("event::::", json.dumps(event))
+
+    try:
+        emails = event.get('emails') or records.list_emails()
+        if not isinstance(emails, list) or not all(isinstance(email, str) for email in emails):
+            return error_response(event, 400, "emails must be a list of email addresses")
+        emails = list(dict.fromkeys(emails))
+        max_parallelism = max(1, int(event.get('max_parallelism') or REEVALUATION_MAX_PARALLELISM))
+
+        started_at = time.time()
+        # Revalidated rather than read from the container cache, since the matrix has just changed
+        matrix = load_matrix(max_age=0)
+        save_snapshot(*matrix)
+
+        client = bedrock_client("bedrock-agent-runtime", AWS_REGION, PRIORITY_BACKGROUND)
+
+        results = []
+        if emails:
+            with ThreadPoolExecutor(max_workers=min(max_parallelism, len(emails))) as executor:
+                results = list(executor.map(
+                    lambda email: reevaluate_one(client, email, matrix, KNOWLEDGE_BASE_ID, MODEL_ARN),
+                    emails
+                ))
+
+        # Candidates the deadline did not leave room for continue in a fresh invocation
+        deferred = [status['email'] for status in results if status['status'] == "DEFERRED"]
+        if deferred:
+            try:
+                deadline.hand_off(context, {'emails': deferred, 'max_parallelism': max_parallelism,
+                                            'handoffs': event.get('handoffs', 0)})
+            except Exception as e:
+                print(f"Hand-off of {len(deferred)} deferred candidates failed: {str(e)}")
+                for status in results:
+                    if status['status'] == "DEFERRED":
+                        status.update(status="FAILED", error=f"Not re-evaluated before the deadline: {str(e)}")
+
+        # Evaluations whose matrix was never snapshotted are evaluated afresh by the batch evaluator
+        fresh = [status.pop('candidate') for status in results if 'candidate' in status]
+        if fresh:
+            try:
+                deadline.client('lambda', 10).invoke(
+                    FunctionName=BATCH_EVALUATOR_FUNCTION_NAME,
+                    InvocationType='Event',
+                    Payload=json.dumps({'candidates': fresh, 'max_parallelism': max_parallelism})
+                )
+                print(f"Handed {len(fresh)} candidates without a matrix snapshot to {BATCH_EVALUATOR_FUNCTION_NAME}")
+                for status in results:
+                    if status['status'] == "NO_SNAPSHOT" and 'error' not in status:
+                        status['status'] = "BATCH_EVALUATION"
+            except Exception as e:
+                print(f"Hand-off of {len(fresh)} candidates to the batch evaluator failed: {str(e)}")
+                for status in results:
+                    if status['status'] == "NO_SNAPSHOT" and 'error' not in status:
+                        status['error'] = f"Not handed to the batch evaluator: {str(e)}"
+
+        elapsed = time.time() - started_at
+        stats = {
+            "total": len(results),
+            "matrix_version": matrix[1],
+            "max_parallelism": max_parallelism,
+            "competencies_rescored": sum(status.get('rescored', 0) for status in results),
+            "elapsed_seconds": round(elapsed, 2)
+        }
+        for status in results:
+            stats[status['status'].lower()] = stats.get(status['status'].lower(), 0) + 1
+        print(f"Re-evaluation stats: {json.dumps(stats)}")
+        return success_response(event, {"results": results, "stats": stats})
+
+    except Exception as e:
+        import traceback
+        print(f"Error: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return error_response(event, 500, str(e))
+
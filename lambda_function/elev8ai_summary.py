@@ -1,82 +1,32 @@
-import json
+import deadline
+import records
+from http_response import is_preflight, preflight_response, respond
 
-import boto3
+ALLOWED_METHODS = "GET,OPTIONS"
 
 
 def lambda_handler(event, context):
-    if event.get('httpMethod') == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
-                'Access-Control-Allow-Methods': 'GET,POST,OPTIONS',
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({})
-        }
+    if is_preflight(event):
+        return preflight_response(ALLOWED_METHODS)
+    deadline.start(context)
 
     try:
-        TABLE_NAME = 'Elev8-ai-summary'
-
         print('event::::::::::', event)
-        query_params = event.get('queryStringParameters', {})
+        query_params = event.get('queryStringParameters') or {}
 
         email = query_params.get('email', None)
         print('email:::::::::', email)
         if email is None:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'error': 'Internal Server Error'}),
-                "headers": {
-                    "Access-Control-Allow-Origin": "*",  # Or your specific domain
-                    "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-                    "Access-Control-Allow-Methods": "GET,OPTIONS",
-                    "Content-Type": "application/json"
-                },
-            }
-
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(TABLE_NAME)
-        key = {'email': email}
+            return respond(event, 400, {'error': 'Internal Server Error'}, ALLOWED_METHODS)
 
-        response = table.get_item(Key=key)
-        print('response:::::::::', response)
-        print('response[item]:::::::::', response['Item']['summary_json'])
+        # Only the latest summary record is read, not the user's status or chat records
+        item = records.get_latest_summary(email, ['summary_json'])
+        print('item:::::::::', item)
 
-        if 'Item' in response:
-            return {
-                "statusCode": 200,
-                "headers": {
-                    "Access-Control-Allow-Origin": "*",  # Or your specific domain
-                    "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-                    "Access-Control-Allow-Methods": "GET,OPTIONS",
-                    "Content-Type": "application/json"
-                },
-                'body': json.dumps(response['Item']['summary_json'])
-            }
+        if item is not None:
+            return respond(event, 200, item['summary_json'], ALLOWED_METHODS)
 
         else:
-            return {
-                "statusCode": 404,
-                "headers": {
-                    "Access-Control-Allow-Origin": "*",  # Or your specific domain
-                    "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-                    "Access-Control-Allow-Methods": "GET,OPTIONS",
-                    "Content-Type": "application/json"
-                },
-                'body': json.dumps({'message': 'Item not found'})
-            }
+            return respond(event, 404, {'message': 'Item not found'}, ALLOWED_METHODS)
     except Exception as e:
-        return {
-            "statusCode": 500,
-            "headers": {
-                "Access-Control-Allow-Origin": "*",  # Or your specific domain
-                "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-                "Access-Control-Allow-Methods": "GET,OPTIONS",
-                "Content-Type": "application/json"
-            },
-            "body": json.dumps({
-                "error": str(e)
-            })
-        }
+        return respond(event, 500, {"error": str(e)}, ALLOWED_METHODS)
@@ -1,21 +1,35 @@
 import base64
+import hashlib
 import json
 import os
 import time
-from datetime import datetime
 
-import boto3
 from requests_toolbelt.multipart import decoder
 
-# Initialize clients
-bedrock_client = boto3.client('bedrock-agent', region_name='us-east-1')
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.client("s3", region_name='us-east-1')
-lambda_client = boto3.client('lambda', region_name='us-east-1')
-table = dynamodb.Table('Elev8-ai-summary')
+import deadline
+import idempotency
+from artifact_preprocessing import preprocess_artifact
+from artifact_uploads import ARTIFACT_BUCKET, artifact_key, build_metadata, start_ingestion, update_sync_status
+from http_response import ALLOW_HEADERS, is_preflight, preflight_response, respond
 
+# Polling waits this long after each status check, plus the retry delay while the source is not ready
+MAX_POLL_ATTEMPTS = 30
+POLL_INTERVAL_SECONDS = 60
+POLL_RETRY_SECONDS = 10
+# Longest a polling round can take, including status check, status update and evaluator invoke
+POLL_ROUND_SECONDS = POLL_INTERVAL_SECONDS + POLL_RETRY_SECONDS + 15
+# A claimed upload blocks duplicates this long even if its invocation dies without releasing it
+UPLOAD_LOCK_SECONDS = 3600
 
-def invoke_evaluator_lambda(email, name, to_designation, from_designation):
+ALLOWED_METHODS = "POST,OPTIONS"
+UPLOAD_ALLOW_HEADERS = f"{ALLOW_HEADERS},Idempotency-Key"
+
+
+def upload_response(event, status_code, data):
+    return respond(event, status_code, data, ALLOWED_METHODS, UPLOAD_ALLOW_HEADERS)
+
+
+def invoke_evaluator_lambda(email, name, to_designation, from_designation, artifact_hash=None):
     """Invoke the evaluator Lambda function with the metadata"""
     try:
         payload = {
@@ -23,9 +37,14 @@ def invoke_evaluator_lambda(email, name, to_designation, from_designation):
             "name": name,
             "to_designation": to_designation,
             "from_designation": from_designation,
+            "artifact_hash": artifact_hash,
+            # Async retries and repeated uploads of the same artifact evaluate it only once
+            "idempotency_key": idempotency.make_key(
+                'evaluate', email, artifact_hash, from_designation, to_designation
+            )
         }
 
-        response = lambda_client.invoke(
+        response = deadline.client('lambda', 10, region_name='us-east-1').invoke(
             FunctionName='Elev8AI-Evaluator',
             InvocationType='Event',  # Asynchronous invocation
             Payload=json.dumps(payload)
@@ -38,41 +57,10 @@ def invoke_evaluator_lambda(email, name, to_designation, from_designation):
         return False
 
 
-def update_sync_status(email, status, error_message=None):
-    """Update sync status in DynamoDB without affecting other attributes"""
-    timestamp = datetime.utcnow().isoformat()
-
-    update_expression = "SET #status = :status, #last_updated = :timestamp"
-    expression_attribute_names = {
-        '#status': 'status',
-        '#last_updated': 'last_updated'
-    }
-    expression_attribute_values = {
-        ':status': status,
-        ':timestamp': timestamp
-    }
-
-    if error_message:
-        update_expression += ", #error = :error"
-        expression_attribute_names['#error'] = 'error_message'
-        expression_attribute_values[':error'] = error_message
-
-    try:
-        table.update_item(
-            Key={'email': email},
-            UpdateExpression=update_expression,
-            ExpressionAttributeNames=expression_attribute_names,
-            ExpressionAttributeValues=expression_attribute_values
-        )
-    except Exception as e:
-        print(f"Error updating DynamoDB: {str(e)}")
-        raise
-
-
 def check_data_source_status(knowledge_base_id, data_source_id):
     """Check the status of the data source"""
     try:
-        response = bedrock_client.get_data_source(
+        response = deadline.client('bedrock-agent', 10, region_name='us-east-1').get_data_source(
             knowledgeBaseId=knowledge_base_id,
             dataSourceId=data_source_id
         )
@@ -113,6 +101,7 @@ def process_multipart_data(body, content_type):
 def upload_to_s3(bucket, file_content, file_name, metadata_content, metadata_file_name):
     """Upload file and metadata to S3"""
     try:
+        s3 = deadline.client('s3', 60, region_name='us-east-1')
         s3.put_object(
             Bucket=bucket,
             Key=file_name,
@@ -132,18 +121,121 @@ def upload_to_s3(bucket, file_content, file_name, metadata_content, metadata_fil
         raise
 
 
+def poll_data_source(event, context, knowledge_base_id, data_source_id, upload, attempt=0):
+    """Poll the data source until it is available, then invoke the evaluator"""
+    email = upload['email']
+    last_status = None
+
+    while attempt < MAX_POLL_ATTEMPTS:
+        # Hand off to a fresh invocation while there is still time to do it cleanly
+        if not deadline.current().has_time_for(POLL_ROUND_SECONDS):
+            return hand_off_polling(event, context, upload, attempt, last_status)
+
+        status = check_data_source_status(knowledge_base_id, data_source_id)
+        last_status = status
+        print(last_status)
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+        if status == 'AVAILABLE':
+            # Invoke evaluator Lambda before returning success
+            invoke_evaluator_lambda(
+                email, upload['name'], upload['to_designation'], upload['from_designation'],
+                upload.get('artifact_hash')
+            )
+
+            update_sync_status(email, 'COMPLETED')
+            return upload_response(event, 200, {
+                'message': 'File uploaded and knowledge base is available',
+                'status': status,
+                'evaluator_invoked': True
+            })
+        elif status in ['CREATING', 'UPDATING']:
+            print(f"Knowledge base data source is being prepared (status: {status})")
+            time.sleep(POLL_RETRY_SECONDS)
+            attempt += 1
+        elif status == 'FAILED':
+            error_message = 'Knowledge base data source failed to sync'
+            update_sync_status(email, 'FAILED', error_message)
+            return upload_response(event, 500, {
+                'message': error_message,
+                'status': status
+            })
+        else:
+            print(f"Current status: {status}")
+            time.sleep(POLL_RETRY_SECONDS)
+            attempt += 1
+
+    # Timeout case
+    timeout_message = f'Knowledge base did not become available after {MAX_POLL_ATTEMPTS} attempts'
+    update_sync_status(email, 'TIMEOUT', timeout_message)
+    return upload_response(event, 408, {
+        'message': timeout_message,
+        'lastStatus': last_status
+    })
+
+
+def hand_off_polling(event, context, upload, attempt, last_status):
+    """Continue polling in a new invocation; the status stays IN_PROGRESS meanwhile"""
+    continuation = {
+        'continuation': dict(upload, attempt=attempt),
+        'handoffs': event.get('handoffs', 0)
+    }
+    deadline.hand_off(context, continuation)
+    return upload_response(event, 202, {
+        'message': 'File uploaded, knowledge base sync is still in progress',
+        'status': last_status,
+        'evaluator_invoked': False
+    })
+
+
+def resume_polling(event, context):
+    """Entry point for polling handed off by an earlier invocation"""
+    upload = dict(event['continuation'])
+    attempt = upload.pop('attempt', 0)
+    try:
+        response = poll_data_source(
+            event, context, os.getenv("KNOWLEDGE_BASE_ID"), os.getenv("DATA_SOURCE_ID"), upload, attempt
+        )
+        return finish_upload(upload, response)
+    except Exception as e:
+        print(f"Error resuming polling: {str(e)}")
+        update_sync_status(upload['email'], 'FAILED', str(e))
+        if upload.get('idempotency_key'):
+            idempotency.release(upload['idempotency_key'], upload.get('idempotency_owner'))
+        raise
+
+
+def finish_upload(upload, response):
+    """Store a successful response for duplicate uploads; release the claim on final failures"""
+    idempotency_key = upload.get('idempotency_key')
+    if idempotency_key:
+        if response['statusCode'] == 200:
+            idempotency.complete(idempotency_key, response)
+        elif response['statusCode'] != 202:
+            idempotency.release(idempotency_key, upload.get('idempotency_owner'))
+    return response
+
+
+def duplicate_upload_response(event, duplicate):
+    """Replay the stored response of a completed upload, or report one still in progress"""
+    if duplicate.status == idempotency.STATUS_COMPLETED and duplicate.result:
+        print(f"Returning stored response for duplicate upload {duplicate.key}")
+        return duplicate.result
+    return upload_response(event, 202, {
+        'message': 'An identical upload is already being processed',
+        'status': duplicate.status
+    })
+
+
 def lambda_handler(event, context):
-    if event.get('httpMethod') == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
-                'Access-Control-Allow-Methods': 'POST,OPTIONS',
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({})
-        }
+    if is_preflight(event):
+        return preflight_response(ALLOWED_METHODS, UPLOAD_ALLOW_HEADERS)
+    deadline.start(context)
+
+    # Polling handed off by an earlier invocation that was running out of time
+    if 'continuation' in event:
+        return resume_polling(event, context)
+
     try:
         # Get environment variables
         KNOWLEDGE_BASE_ID = os.getenv("KNOWLEDGE_BASE_ID")
@@ -174,113 +266,54 @@ def lambda_handler(event, context):
         if not all([file, email, name, to_designation, from_designation]):
             raise ValueError("Missing required form fields")
 
+        artifact_hash = hashlib.sha256(file['content']).hexdigest()[:16]
+        headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+        if headers.get('idempotency-key'):
+            idempotency_key = idempotency.make_key('upload', email, headers['idempotency-key'])
+        else:
+            idempotency_key = idempotency.make_key(
+                'upload', email, artifact_hash, name, to_designation, from_designation
+            )
+
+        try:
+            idempotency_owner = idempotency.claim(idempotency_key, UPLOAD_LOCK_SECONDS)
+        except idempotency.DuplicateRequestError as duplicate:
+            return duplicate_upload_response(event, duplicate)
+
         # Prepare file names and metadata
-        file_name = f'artifacts/{email.split("@")[0]}/{email.split("@")[0]}.pdf'
+        file_name = artifact_key(email)
         metadata_file_name = f'{file_name}.metadata.json'
-
-        metadata = {
-            "metadataAttributes": {
-                "email": email,
-                "name": name,
-                "to_designation": to_designation,
-                "from_designation": from_designation,
-                "tags": ["artifact", "arko tags"]
-            }
-        }
+        metadata = build_metadata(email, name, to_designation, from_designation)
 
         # Upload to S3
         upload_to_s3(
-            'elev8ai',
+            ARTIFACT_BUCKET,
             file['content'],
             file_name,
             json.dumps(metadata),
             metadata_file_name
         )
 
-        # Start knowledge base sync
-        try:
-            bedrock_client.start_ingestion_job(
-                knowledgeBaseId=KNOWLEDGE_BASE_ID,
-                dataSourceId=DATA_SOURCE_ID
-            )
-        except Exception as e:
-            print(f"Error starting sync job: {str(e)}")
-            # Continue even if sync start fails, as we'll check status below
+        # Extract and chunk the text locally when enabled, writing only chunks that changed
+        preprocess_artifact(ARTIFACT_BUCKET, file['content'], metadata, artifact_hash)
+
+        # Start knowledge base sync; continue even if sync start fails, as we'll check status below
+        start_ingestion(KNOWLEDGE_BASE_ID, DATA_SOURCE_ID)
 
         # Update initial status
-        update_sync_status(email, 'IN_PROGRESS')
-
-        # Poll for completion
-        max_attempts = 30
-        attempt = 0
-        last_status = None
-
-        while attempt < max_attempts:
-            status = check_data_source_status(KNOWLEDGE_BASE_ID, DATA_SOURCE_ID)
-            last_status = status
-            print(last_status)
-            time.sleep(60)
-
-            if status == 'AVAILABLE':
-                # Invoke evaluator Lambda before returning success
-                invoke_evaluator_lambda(email, name, to_designation, from_designation)
-
-                update_sync_status(email, 'COMPLETED')
-                return {
-                    'statusCode': 200,
-                    "headers": {
-                        "Access-Control-Allow-Origin": "*",  # Or your specific domain
-                        "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-                        "Access-Control-Allow-Methods": "POST,GET,OPTIONS",
-                        "Content-Type": "application/json"
-                    },
-                    'body': json.dumps({
-                        'message': 'File uploaded and knowledge base is available',
-                        'status': status,
-                        'evaluator_invoked': True
-                    })
-                }
-            elif status in ['CREATING', 'UPDATING']:
-                print(f"Knowledge base data source is being prepared (status: {status})")
-                time.sleep(10)
-                attempt += 1
-            elif status == 'FAILED':
-                error_message = 'Knowledge base data source failed to sync'
-                update_sync_status(email, 'FAILED', error_message)
-                return {
-                    'statusCode': 500,
-                    "headers": {
-                        "Access-Control-Allow-Origin": "*",  # Or your specific domain
-                        "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-                        "Access-Control-Allow-Methods": "POST,GET,OPTIONS",
-                        "Content-Type": "application/json"
-                    },
-                    'body': json.dumps({
-                        'message': error_message,
-                        'status': status
-                    })
-                }
-            else:
-                print(f"Current status: {status}")
-                time.sleep(10)
-                attempt += 1
-
-        # Timeout case
-        timeout_message = f'Knowledge base did not become available after {max_attempts} attempts'
-        update_sync_status(email, 'TIMEOUT', timeout_message)
-        return {
-            'statusCode': 408,
-            'body': json.dumps({
-                'message': timeout_message,
-                'lastStatus': last_status
-            }),
-            "headers": {
-                "Access-Control-Allow-Origin": "*",  # Or your specific domain
-                "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-                "Access-Control-Allow-Methods": "POST,GET,OPTIONS",
-                "Content-Type": "application/json"
-            },
+        update_sync_status(email, 'IN_PROGRESS', artifact_hash=artifact_hash)
+
+        upload = {
+            'email': email,
+            'name': name,
+            'to_designation': to_designation,
+            'from_designation': from_designation,
+            'artifact_hash': artifact_hash,
+            'idempotency_key': idempotency_key,
+            'idempotency_owner': idempotency_owner
         }
+        response = poll_data_source(event, context, KNOWLEDGE_BASE_ID, DATA_SOURCE_ID, upload)
+        return finish_upload(upload, response)
 
     except Exception as e:
         error_message = str(e)
@@ -291,6 +324,9 @@ def lambda_handler(event, context):
             'error': error_message
         }
 
+        if 'idempotency_owner' in locals():
+            idempotency.release(idempotency_key, idempotency_owner)
+
         if 'email' in locals():
             response_body['email'] = email
             try:
@@ -299,13 +335,4 @@ def lambda_handler(event, context):
                 print(f"Failed to update DynamoDB: {str(db_error)}")
                 response_body['dbUpdateError'] = str(db_error)
 
-        return {
-            'statusCode': 500,
-            'body': json.dumps(response_body),
-            "headers": {
-                "Access-Control-Allow-Origin": "*",  # Or your specific domain
-                "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-                "Access-Control-Allow-Methods": "POST,GET,OPTIONS",
-                "Content-Type": "application/json"
-            },
-        }
+        return upload_response(event, 500, response_body)
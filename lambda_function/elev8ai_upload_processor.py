@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+from urllib.parse import unquote, unquote_plus
+
+import deadline
+import idempotency
+from artifact_preprocessing import preprocess_artifact, preprocessing_enabled
+from artifact_uploads import (
+    PRESIGNED_UPLOAD_MODE, UPLOAD_METADATA_FIELDS, UPLOAD_MODE_METADATA,
+    artifact_key, build_metadata, object_metadata_name, start_ingestion, update_sync_status
+)
+
+# Upload Lambda that polls the knowledge base sync and invokes the evaluator
+UPLOAD_FUNCTION_NAME = os.getenv("UPLOAD_FUNCTION_NAME", "Elev8AI-Upload")
+UPLOAD_LOCK_SECONDS = 3600
+
+
+def read_upload(bucket, key):
+    """Form fields of a presigned upload, or None for objects written some other way"""
+    head = deadline.client('s3', 5, region_name='us-east-1').head_object(Bucket=bucket, Key=key)
+    metadata = head.get('Metadata', {})
+    if metadata.get(UPLOAD_MODE_METADATA) != PRESIGNED_UPLOAD_MODE:
+        return None
+    upload = {field: unquote(metadata.get(object_metadata_name(field), '')) for field in UPLOAD_METADATA_FIELDS}
+    if not all(upload.values()) or artifact_key(upload['email']) != key:
+        print(f"Ignoring {key}: incomplete or mismatched upload metadata")
+        return None
+    return upload
+
+
+def process_upload(bucket, key, etag, knowledge_base_id, data_source_id):
+    """Write the metadata sidecar, mark the upload in progress, start the sync and hand off polling"""
+    upload = read_upload(bucket, key)
+    if upload is None:
+        return False
+
+    email = upload['email']
+    # The ETag identifies the object content without reading it back
+    upload['artifact_hash'] = hashlib.sha256(etag.encode('utf-8')).hexdigest()[:16]
+    upload['idempotency_key'] = idempotency.make_key(
+        'upload', email, upload['artifact_hash'], upload['name'],
+        upload['to_designation'], upload['from_designation']
+    )
+    try:
+        upload['idempotency_owner'] = idempotency.claim(upload['idempotency_key'], UPLOAD_LOCK_SECONDS)
+    except idempotency.DuplicateRequestError as duplicate:
+        print(f"Skipping duplicate event for {key} ({duplicate.status})")
+        return False
+
+    try:
+        metadata = build_metadata(email, upload['name'], upload['to_designation'], upload['from_designation'])
+        deadline.client('s3', 10, region_name='us-east-1').put_object(
+            Bucket=bucket,
+            Key=f'{key}.metadata.json',
+            ContentType='application/json',
+            Body=json.dumps(metadata)
+        )
+        if preprocessing_enabled():
+            content = deadline.client('s3', 60, region_name='us-east-1').get_object(Bucket=bucket, Key=key)['Body'].read()
+            preprocess_artifact(bucket, content, metadata, upload['artifact_hash'])
+        update_sync_status(email, 'IN_PROGRESS', artifact_hash=upload['artifact_hash'])
+        start_ingestion(knowledge_base_id, data_source_id)
+
+        # Polling takes minutes, so it continues in the upload Lambda's continuation path
+        deadline.client('lambda', 10, region_name='us-east-1').invoke(
+            FunctionName=UPLOAD_FUNCTION_NAME,
+            InvocationType='Event',
+            Payload=json.dumps({'continuation': dict(upload, attempt=0), 'handoffs': 0})
+        )
+        print(f"Processed upload {key} for {email}")
+        return True
+    except Exception as e:
+        update_sync_status(email, 'FAILED', str(e))
+        idempotency.release(upload['idempotency_key'], upload['idempotency_owner'])
+        raise
+
+
+def lambda_handler(event, context):
+    """Handle S3 object-created events for artifacts uploaded with a presigned POST"""
+    deadline.start(context)
+    KNOWLEDGE_BASE_ID = os.getenv("KNOWLEDGE_BASE_ID")
+    DATA_SOURCE_ID = os.getenv("DATA_SOURCE_ID")
+
+    print("event::::", json.dumps(event))
+
+    processed = 0
+    failures = []
+    for record in event.get('Records', []):
+        bucket = record['s3']['bucket']['name']
+        key = unquote_plus(record['s3']['object']['key'])
+        if key.endswith('.metadata.json'):
+            continue
+        try:
+            if process_upload(bucket, key, record['s3']['object'].get('eTag', key), KNOWLEDGE_BASE_ID, DATA_SOURCE_ID):
+                processed += 1
+        except Exception as e:
+            print(f"Error processing upload {key}: {str(e)}")
+            failures.append(key)
+
+    # Raising lets Lambda retry the event; processed records are skipped as duplicates
+    if failures:
+        raise Exception(f"Failed to process uploads: {', '.join(failures)}")
+    return {"processed": processed}
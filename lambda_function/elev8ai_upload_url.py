@@ -0,0 +1,81 @@
+import base64
+import json
+import os
+from urllib.parse import quote
+
+import deadline
+from artifact_uploads import (
+    ARTIFACT_BUCKET, PRESIGNED_UPLOAD_MODE, UPLOAD_METADATA_FIELDS, UPLOAD_MODE_METADATA,
+    artifact_key, object_metadata_name, record_upload_request
+)
+from http_response import is_preflight, preflight_response, respond
+
+# Largest artifact accepted, matching the knowledge base's per-file limit
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_URL_EXPIRY_SECONDS = int(os.getenv("UPLOAD_URL_EXPIRY_SECONDS", "900"))
+UPLOAD_CONTENT_TYPE = 'application/pdf'
+
+ALLOWED_METHODS = "POST,OPTIONS"
+
+
+def metadata_field(name):
+    return f"x-amz-meta-{object_metadata_name(name)}"
+
+
+def create_upload_post(request):
+    """Presigned POST for the user's artifact key, bound to its size, type and form fields
+
+    The form fields travel as object metadata (URL-quoted, since S3 metadata
+    must be ASCII) for the processor to build the knowledge-base sidecar from.
+    """
+    # The upload-mode marker tells elev8ai_upload_processor the object came through this path
+    fields = {'Content-Type': UPLOAD_CONTENT_TYPE, metadata_field(UPLOAD_MODE_METADATA): PRESIGNED_UPLOAD_MODE}
+    for name in UPLOAD_METADATA_FIELDS:
+        fields[metadata_field(name)] = quote(request[name], safe='@')
+    conditions = [{name: value} for name, value in fields.items()]
+    conditions.append(["content-length-range", 1, MAX_UPLOAD_BYTES])
+
+    return deadline.client('s3', 5, region_name='us-east-1').generate_presigned_post(
+        Bucket=ARTIFACT_BUCKET,
+        Key=artifact_key(request['email']),
+        Fields=fields,
+        Conditions=conditions,
+        ExpiresIn=UPLOAD_URL_EXPIRY_SECONDS
+    )
+
+
+def lambda_handler(event, context):
+    if is_preflight(event):
+        return preflight_response(ALLOWED_METHODS)
+    deadline.start(context)
+
+    try:
+        body = event.get('body') or '{}'
+        if event.get('isBase64Encoded'):
+            body = base64.b64decode(body).decode('utf-8')
+        request = json.loads(body)
+
+        missing = [name for name in UPLOAD_METADATA_FIELDS if not request.get(name)]
+        if missing:
+            return error_response(event, 400, f"Missing required fields: {', '.join(missing)}")
+        content_length = request.get('content_length')
+        if content_length is not None and not 0 < int(content_length) <= MAX_UPLOAD_BYTES:
+            return error_response(event, 413, f"Artifacts must be between 1 byte and {MAX_UPLOAD_BYTES} bytes")
+
+        upload_post = create_upload_post(request)
+        record_upload_request(request['email'])
+
+        return respond(event, 200, {
+            'upload': upload_post,
+            'expires_in': UPLOAD_URL_EXPIRY_SECONDS,
+            'max_bytes': MAX_UPLOAD_BYTES
+        }, ALLOWED_METHODS)
+    except (ValueError, TypeError) as e:
+        return error_response(event, 400, f"Invalid request: {str(e)}")
+    except Exception as e:
+        print(f"Error creating upload URL: {str(e)}")
+        return error_response(event, 500, str(e))
+
+
+def error_response(event, code, message):
+    return respond(event, code, {'message': 'Error creating upload URL', 'error': message}, ALLOWED_METHODS)
@@ -1,45 +1,18 @@
-import json
+import deadline
+import records
+from http_response import is_preflight, preflight_response, respond
 
-import boto3
+ALLOWED_METHODS = "GET,OPTIONS"
 
 
 def lambda_handler(event, context):
+    if is_preflight(event):
+        return preflight_response(ALLOWED_METHODS)
+    deadline.start(context)
     try:
-        result = {
-            "message": "Success",
-            "data": "Your data here"
-        }
+        emails = records.list_emails()
 
-        TABLE_NAME = 'Elev8-ai-summary'
-
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(TABLE_NAME)
-
-        response = table.scan()
-
-        emails = [item['email'] for item in response.get('Items', [])]
-
-        return {
-            "statusCode": 200,
-            "headers": {
-                "Access-Control-Allow-Origin": "*",  # Or your specific domain
-                "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-                "Access-Control-Allow-Methods": "GET,OPTIONS",
-                "Content-Type": "application/json"
-            },
-            'body': json.dumps({'emails': emails}),
-        }
+        return respond(event, 200, {'emails': emails}, ALLOWED_METHODS)
 
     except Exception as e:
-        return {
-            "statusCode": 500,
-            "headers": {
-                "Access-Control-Allow-Origin": "*",  # Or your specific domain
-                "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-                "Access-Control-Allow-Methods": "GET,OPTIONS",
-                "Content-Type": "application/json"
-            },
-            "body": json.dumps({
-                "error": str(e)
-            })
-        }
+        return respond(event, 500, {"error": str(e)}, ALLOWED_METHODS)
@@ -0,0 +1,336 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from bedrock_admission import PRIORITY_BACKGROUND, AdmissionRejectedError, call_bedrock
+from deadline import DeadlineExceededError
+from evaluation_parser import AREAS_OF_IMPROVEMENT, COMPETENCY_MATCHES, REQUIRED_PARTS, parse_evaluation, part_request
+from matrix_utils import (
+    evaluation_levels, get_matrix_projection, get_matrix_shards, load_matrix, minify_json, normalize_name,
+    project_matrix
+)
+from matrix_versions import competency_subset, save_snapshot
+from prompt_templates import estimate_tokens, get_template
+from retrieval_cache import RETRIEVAL_MODE, candidate_chunks, candidate_retrieval, generate_from_chunks
+from retrieval_policy import vector_search_configuration
+from score_aggregation import aggregate_scores, competency_match_list, get_matrix_index, qualify_names
+
+# "category" or "area" splits the evaluation into concurrent shards; empty evaluates the whole matrix at once
+EVALUATOR_SHARD_BY = os.getenv("EVALUATOR_SHARD_BY", "")
+EVALUATOR_MAX_WORKERS = int(os.getenv("EVALUATOR_MAX_WORKERS", "4"))
+EVALUATOR_SHARD_ATTEMPTS = int(os.getenv("EVALUATOR_SHARD_ATTEMPTS", "3"))
+# Generations per evaluation (or shard) when parts of the output cannot be recovered
+EVALUATOR_OUTPUT_ATTEMPTS = int(os.getenv("EVALUATOR_OUTPUT_ATTEMPTS", "3"))
+# Output limit of split-mode evaluator generations, which are far longer than chat answers
+EVALUATOR_MAX_TOKENS = int(os.getenv("EVALUATOR_MAX_TOKENS", "8192"))
+
+
+class EvaluationOutputError(Exception):
+    """Raised when parts of an evaluation are still missing after EVALUATOR_OUTPUT_ATTEMPTS generations"""
+
+    def __init__(self, label, missing_parts):
+        super().__init__(f"{label}: no valid {', '.join(missing_parts)} in the evaluation output")
+        self.missing_parts = missing_parts
+
+
+class EvaluationCheckpoint(Exception):
+    """Raised when the invocation deadline stops a sharded evaluation part way
+
+    checkpoint holds the matrix version and the results of the shards that
+    completed, and can be passed back to evaluate_candidate to resume.
+    """
+
+    def __init__(self, checkpoint, pending_shards):
+        super().__init__(f"Deadline reached with {len(pending_shards)} shards pending")
+        self.checkpoint = checkpoint
+        self.pending_shards = pending_shards
+
+
+def retrieve_candidate_chunks(client, candidate_email, knowledge_base_id, artifact_hash=None):
+    """Retrieve the candidate's chunks once for every shard and attempt of an evaluation"""
+    chunks, cached = candidate_chunks(client, knowledge_base_id, candidate_email, artifact_hash, PRIORITY_BACKGROUND)
+    if cached:
+        print(f"Using {len(chunks)} cached chunks ({cached}) for {candidate_email}")
+    return chunks
+
+
+def generate_assessment(client, candidate_email, prompt, knowledge_base_id, model_arn, chunks=None):
+    """Run one evaluation over the candidate's artifacts and return the raw text
+
+    With chunks, the evaluation is generated from those already retrieved
+    chunks; without, retrieve_and_generate retrieves them itself.
+    """
+    if chunks is not None:
+        return generate_from_chunks(client, model_arn, prompt, chunks, PRIORITY_BACKGROUND, EVALUATOR_MAX_TOKENS)
+
+    response = call_bedrock(
+        client,
+        "retrieve_and_generate",
+        PRIORITY_BACKGROUND,
+        input={"text": candidate_email},
+        retrieveAndGenerateConfiguration={
+            "knowledgeBaseConfiguration": {
+                "knowledgeBaseId": knowledge_base_id,
+                "modelArn": model_arn,
+                "retrievalConfiguration": {
+                    "vectorSearchConfiguration": vector_search_configuration(candidate_retrieval(candidate_email))
+                },
+                "generationConfiguration": {
+                    "promptTemplate": {
+                        "textPromptTemplate": prompt
+                    }
+                }
+            },
+            "type": "KNOWLEDGE_BASE"
+        }
+    )
+    print("response from llm", response)
+    return response["output"]["text"].strip()
+
+
+def generate_evaluation(client, label, candidate_email, prompt, knowledge_base_id, model_arn, chunks=None,
+                        parts=REQUIRED_PARTS):
+    """Generate and parse the given parts of an evaluation, requesting again only those that could not be recovered"""
+    evaluation = {}
+    missing = list(parts)
+    for attempt in range(1, EVALUATOR_OUTPUT_ATTEMPTS + 1):
+        raw_response = generate_assessment(
+            client, candidate_email, part_request(prompt, missing), knowledge_base_id, model_arn, chunks
+        )
+        parsed, missing = parse_evaluation(raw_response, missing)
+        # Parts that were already valid are kept over any repeated in a part request's output
+        evaluation.update({part: value for part, value in parsed.items() if part not in evaluation})
+        if not missing:
+            return evaluation
+        print(f"{label}: output attempt {attempt}/{EVALUATOR_OUTPUT_ATTEMPTS} is missing {', '.join(missing)}")
+    raise EvaluationOutputError(label, missing)
+
+
+def evaluate_shard(client, shard_name, candidate_email, prompt, knowledge_base_id, model_arn, chunks=None):
+    """Evaluate one shard, retrying only this shard on failures
+
+    Unusable output is handled by generate_evaluation, which requests just
+    the failed parts again, so it does not restart the shard.
+    """
+    last_error = None
+    for attempt in range(1, EVALUATOR_SHARD_ATTEMPTS + 1):
+        try:
+            result = generate_evaluation(
+                client, f"Shard {shard_name}", candidate_email, prompt, knowledge_base_id, model_arn, chunks
+            )
+            print(f"Shard {shard_name} evaluated on attempt {attempt}")
+            return result
+        except (DeadlineExceededError, AdmissionRejectedError, EvaluationOutputError):
+            raise
+        except Exception as e:
+            last_error = e
+            print(f"Shard {shard_name} attempt {attempt}/{EVALUATOR_SHARD_ATTEMPTS} failed: {str(e)}")
+    raise Exception(f"Shard {shard_name} failed after {EVALUATOR_SHARD_ATTEMPTS} attempts: {str(last_error)}")
+
+
+def merge_shard_results(shard_results, index=None):
+    """Combine shard outputs in matrix order into a single assessment
+
+    The summary describes the artifact rather than a matrix slice, so the
+    first non-empty shard summary is used. Competency matches and areas of
+    improvement are concatenated, keeping the first entry per competency.
+    With the matrix index, keys shared by several areas are first resolved
+    to the area/competency name within each shard's category or area.
+    """
+    merged = {"summary": "", "competency_matches": [], "areas_of_improvement": []}
+    seen_competencies = set()
+    seen_improvements = set()
+    for shard_name, result in shard_results:
+        if not merged["summary"] and result.get("summary"):
+            merged["summary"] = result["summary"]
+
+        matches = competency_match_list(result.get("competency_matches"))
+        improvements = result.get("areas_of_improvement")
+        if index is not None:
+            prefix = tuple(shard_name.split("/"))
+            qualify_names(matches, "name", index, prefix)
+            if isinstance(improvements, list):
+                qualify_names([entry for entry in improvements if isinstance(entry, dict)], "competency", index, prefix)
+
+        for match in matches:
+            name = normalize_name(match.get("name", ""))
+            if name not in seen_competencies:
+                seen_competencies.add(name)
+                merged["competency_matches"].append(match)
+
+        for improvement in improvements if isinstance(improvements, list) else []:
+            name = normalize_name(improvement.get("competency", "")) if isinstance(improvement, dict) else None
+            if name not in seen_improvements:
+                seen_improvements.add(name)
+                merged["areas_of_improvement"].append(improvement)
+    return merged
+
+
+def evaluate_sharded(client, candidate_email, shards, template, from_designation, to_designation,
+                     knowledge_base_id, model_arn, matrix_version, completed_shards=None, chunks=None, index=None):
+    """Evaluate matrix shards concurrently in a bounded thread pool and merge them deterministically
+
+    Shards found in completed_shards are reused instead of evaluated again.
+    index is the MatrixIndex used to resolve shared competency keys.
+    """
+    completed_shards = completed_shards or {}
+    with ThreadPoolExecutor(max_workers=max(1, min(EVALUATOR_MAX_WORKERS, len(shards)))) as executor:
+        futures = []
+        for shard_name, shard_matrix in shards:
+            if shard_name in completed_shards:
+                continue
+            prompt = template.render(
+                matrix=shard_matrix,
+                from_designation=from_designation,
+                to_designation=to_designation
+            )
+            futures.append((shard_name, executor.submit(
+                evaluate_shard, client, shard_name, candidate_email, prompt, knowledge_base_id, model_arn, chunks
+            )))
+
+        results = dict(completed_shards)
+        failures = []
+        pending = []
+        for shard_name, future in futures:
+            try:
+                results[shard_name] = future.result()
+            except (DeadlineExceededError, AdmissionRejectedError):
+                # Shards that ran out of time, including while waiting for admission, resume from the checkpoint
+                pending.append(shard_name)
+            except Exception as e:
+                failures.append(str(e))
+
+    if failures:
+        raise Exception(f"{len(failures)} of {len(shards)} evaluation shards failed: {'; '.join(failures)}")
+    if pending:
+        raise EvaluationCheckpoint({"matrix_version": matrix_version, "shards": results}, pending)
+    return merge_shard_results([(shard_name, results[shard_name]) for shard_name, _ in shards], index)
+
+
+def evaluate_candidate(client, candidate_email, from_designation, to_designation, knowledge_base_id, model_arn,
+                       shard_by=None, matrix=None, checkpoint=None, artifact_hash=None):
+    """Evaluate a candidate against the competency matrix
+
+    Returns (assessment, details) where assessment is the parsed evaluation
+    with locally computed rollups and details holds the template and matrix
+    versions and the designations used. Raises EvaluationOutputError, rather
+    than returning unusable output, when parts of the evaluation cannot be
+    recovered. matrix optionally pins a (matrix, version) pair loaded by the
+    caller, e.g. to evaluate a whole batch against the same revision.
+    checkpoint resumes a sharded evaluation from an EvaluationCheckpoint
+    taken against the same matrix version. artifact_hash lets the retrieved
+    chunks be cached for that version of the candidate's artifact.
+    """
+    shard_by = EVALUATOR_SHARD_BY if shard_by is None else shard_by
+
+    # Get the competency matrix, projected down to the levels this transition needs
+    matrix_json, matrix_version = matrix or load_matrix()
+    template = get_template("evaluator")
+    details = {
+        "prompt_version": template.template_id,
+        "matrix_version": matrix_version,
+        "from_designation": from_designation,
+        "to_designation": to_designation
+    }
+    # Kept so a later matrix revision can be diffed against the one this evaluation used
+    save_snapshot(matrix_json, matrix_version)
+
+    chunks = None
+    if RETRIEVAL_MODE == "split":
+        chunks = retrieve_candidate_chunks(client, candidate_email, knowledge_base_id, artifact_hash)
+
+    if shard_by:
+        shards = get_matrix_shards(matrix_json, matrix_version, from_designation, to_designation, shard_by)
+        completed_shards = None
+        if checkpoint and checkpoint.get("matrix_version") == matrix_version:
+            completed_shards = checkpoint.get("shards")
+            print(f"Resuming with {len(completed_shards or {})} completed shards")
+        print(f"Evaluating {candidate_email} in {len(shards)} {shard_by} shards with {template.template_id}")
+        assessment_result = evaluate_sharded(
+            client, candidate_email, shards, template, from_designation, to_designation,
+            knowledge_base_id, model_arn, matrix_version, completed_shards, chunks,
+            get_matrix_index(matrix_json, matrix_version)
+        )
+    else:
+        matrix_text = get_matrix_projection(matrix_json, matrix_version, from_designation, to_designation)
+        prompt = template.render(
+            matrix=matrix_text,
+            from_designation=from_designation,
+            to_designation=to_designation
+        )
+        print(f"Rendered prompt {template.template_id} (~{estimate_tokens(prompt)} tokens)")
+        assessment_result = generate_evaluation(
+            client, candidate_email, candidate_email, prompt, knowledge_base_id, model_arn, chunks
+        )
+
+    # Area, category and final scores are computed locally from the matrix weights
+    assessment_result = aggregate_scores(assessment_result, get_matrix_index(matrix_json, matrix_version))
+    return assessment_result, details
+
+
+def _without_competencies(entries, key_field, names):
+    return [entry for entry in entries
+            if not (isinstance(entry, dict) and normalize_name(entry.get(key_field, '')) in names)]
+
+
+def rescore_competencies(client, candidate_email, assessment, diff, matrix, from_designation, to_designation,
+                         knowledge_base_id, model_arn, artifact_hash=None):
+    """Move a stored evaluation to a new matrix version, scoring only the competencies that differ
+
+    diff is a matrix_versions.diff_matrices result. Matches and areas of
+    improvement of removed competencies are dropped, changed and added
+    competencies are scored against the new matrix and every other match is
+    kept; the rollups are then recomputed from the new weights. Returns
+    (assessment, details) like evaluate_candidate.
+    """
+    matrix_json, matrix_version = matrix
+    template = get_template("evaluator")
+    details = {
+        "prompt_version": template.template_id,
+        "matrix_version": matrix_version,
+        "from_designation": from_designation,
+        "to_designation": to_designation
+    }
+    rescore = set(diff["changed"]) | set(diff["added"])
+    replaced = rescore | set(diff["removed"])
+
+    improvements = assessment.get(AREAS_OF_IMPROVEMENT)
+    assessment = dict(
+        assessment,
+        competency_matches=_without_competencies(
+            competency_match_list(assessment.get(COMPETENCY_MATCHES)), "name", replaced
+        ),
+        areas_of_improvement=_without_competencies(
+            improvements if isinstance(improvements, list) else [], "competency", replaced
+        )
+    )
+
+    if rescore:
+        chunks = None
+        if RETRIEVAL_MODE == "split":
+            chunks = retrieve_candidate_chunks(client, candidate_email, knowledge_base_id, artifact_hash)
+        levels = evaluation_levels(from_designation, to_designation)
+        prompt = template.render(
+            matrix=minify_json(project_matrix(competency_subset(matrix_json, rescore), levels)),
+            from_designation=from_designation,
+            to_designation=to_designation
+        )
+        print(f"Rescoring {len(rescore)} competencies of {candidate_email} against matrix version {matrix_version}")
+        rescored = generate_evaluation(
+            client, f"Rescoring {candidate_email}", candidate_email, prompt, knowledge_base_id, model_arn, chunks,
+            parts=(COMPETENCY_MATCHES, AREAS_OF_IMPROVEMENT)
+        )
+        # The sub-matrix may hold only one of several competencies sharing a key, so the model can report it bare
+        index = get_matrix_index(matrix_json, matrix_version)
+        qualify_names(rescored[COMPETENCY_MATCHES], "name", index, names=rescore)
+        qualify_names(rescored[AREAS_OF_IMPROVEMENT], "competency", index, names=rescore)
+        # Only the requested competencies are taken, in case the model scored others too
+        assessment[COMPETENCY_MATCHES] += [
+            match for match in rescored[COMPETENCY_MATCHES] if normalize_name(match["name"]) in rescore
+        ]
+        assessment[AREAS_OF_IMPROVEMENT] += [
+            improvement for improvement in rescored[AREAS_OF_IMPROVEMENT]
+            if normalize_name(improvement["competency"]) in rescore
+        ]
+
+    assessment = aggregate_scores(assessment, get_matrix_index(matrix_json, matrix_version))
+    return assessment, details
@@ -0,0 +1,242 @@
+import json
+import re
+
+SUMMARY = "summary"
+COMPETENCY_MATCHES = "competency_matches"
+AREA_MATCHES = "area_matches"
+FINAL_MATCH = "final_match"
+AREAS_OF_IMPROVEMENT = "areas_of_improvement"
+
+# Parts that must be present for an evaluation to be stored
+REQUIRED_PARTS = (SUMMARY, COMPETENCY_MATCHES, AREAS_OF_IMPROVEMENT)
+
+PERCENTAGE_PATTERN = re.compile(r'-?\d+(?:\.\d+)?')
+# An object whose quotes are escaped, as when the whole output was serialized as a JSON string
+ESCAPED_OBJECT_PATTERN = re.compile(r'\{(?:\s|\\[nrt])*\\"')
+ESCAPE_PATTERN = re.compile(r'\\(["\\/nrt])')
+ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'n': '\n', 'r': '\r', 't': '\t'}
+CLOSING = {'{': '}', '[': ']'}
+
+PART_REQUEST = ("\nRespond with a JSON object containing only these top-level keys, "
+                "structured as described above: {parts}.")
+
+
+class InvalidPart(Exception):
+    """Raised by a compiled validator for a value it cannot repair"""
+
+
+def _object_end(text):
+    """Index just past the object that text starts with, or, if it is cut off, a closed prefix of it
+
+    Returns (end, closing) where closing is appended to text[:end] to close
+    what was left open; it is empty for a complete object. A cut-off object
+    keeps only its completed top-level members.
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    last_member_end = None
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in CLOSING:
+            stack.append(CLOSING[char])
+        elif char in '}]':
+            if not stack or stack.pop() != char:
+                return None, None
+            if not stack:
+                return position + 1, ''
+        elif char == ',' and len(stack) == 1:
+            last_member_end = position
+    if last_member_end is None:
+        return None, None
+    return last_member_end, '}'
+
+
+def extract_json_object(text, start=0):
+    """The outermost JSON object starting at the first { at or after start, as a string, or None"""
+    start = text.find('{', start)
+    if start < 0:
+        return None
+    body = text[start:]
+    if ESCAPED_OBJECT_PATTERN.match(body):
+        body = ESCAPE_PATTERN.sub(lambda match: ESCAPES[match.group(1)], body)
+    end, closing = _object_end(body)
+    if end is None:
+        return None
+    if closing:
+        print(f"Output was cut off after {end} characters, keeping its completed parts")
+    return body[:end] + closing
+
+
+def load_json_object(text):
+    """The first object in text that parses, trying each { in turn, unwrapped; {} when none does
+
+    A { in commentary before the evaluation, e.g. an example, does not hide
+    the evaluation that follows it.
+    """
+    start = text.find('{')
+    while start >= 0:
+        candidate = extract_json_object(text, start)
+        if candidate is not None:
+            try:
+                result = json.loads(candidate, object_pairs_hook=_merge_duplicates)
+                if isinstance(result, dict):
+                    return _unwrap(result)
+            except json.JSONDecodeError as e:
+                print(f"JSON parsing error at {start}: {str(e)}")
+        start = text.find('{', start + 1)
+    return {}
+
+
+def _merge_duplicates(pairs):
+    """object_pairs_hook keeping every value of a repeated key: lists are concatenated, objects merged"""
+    result = {}
+    for key, value in pairs:
+        if key not in result:
+            result[key] = value
+        elif isinstance(result[key], list) and isinstance(value, list):
+            result[key] = result[key] + value
+        elif isinstance(result[key], dict) and isinstance(value, dict):
+            result[key] = dict(result[key], **value)
+        elif value not in (None, '', [], {}):
+            result[key] = value
+    return result
+
+
+def _text(value):
+    if isinstance(value, str) and value.strip():
+        return value
+    if isinstance(value, list) and value and all(isinstance(line, str) for line in value):
+        return " ".join(line.strip() for line in value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise InvalidPart(f"expected text, got {type(value).__name__}")
+
+
+def _optional_text(value):
+    return "" if value is None else _text(value)
+
+
+def _percentage(value):
+    if isinstance(value, bool):
+        raise InvalidPart("expected a percentage, got a boolean")
+    if not isinstance(value, (int, float)):
+        match = PERCENTAGE_PATTERN.search(str(value or ''))
+        if not match:
+            raise InvalidPart(f"expected a percentage, got {value!r}")
+        value = float(match.group())
+    return min(max(float(value), 0.0), 100.0)
+
+
+def _optional_percentage(value):
+    return None if value is None else _percentage(value)
+
+
+def _records(key_field, fields, scalar_field, allow_empty):
+    """Compile a validator for a list of objects with the given field validators
+
+    A name-keyed object becomes a list, with each key moved into key_field
+    and scalar values into scalar_field. Entries that fail validation are
+    dropped; the part itself is invalid only if nothing valid remains.
+    """
+    field_items = tuple(fields.items())
+
+    def validate_entry(entry):
+        entry = dict(entry)
+        for name, check in field_items:
+            value = check(entry.get(name))
+            if value is None:
+                entry.pop(name, None)
+            else:
+                entry[name] = value
+        return entry
+
+    def validate(value):
+        if isinstance(value, dict):
+            value = [
+                dict(entry, **{key_field: key}) if isinstance(entry, dict) else {key_field: key, scalar_field: entry}
+                for key, entry in value.items()
+            ]
+        if not isinstance(value, list):
+            raise InvalidPart(f"expected a list, got {type(value).__name__}")
+        entries = []
+        for entry in value:
+            for item in entry if isinstance(entry, list) else [entry]:
+                if not isinstance(item, dict):
+                    continue
+                try:
+                    entries.append(validate_entry(item))
+                except InvalidPart as e:
+                    print(f"Dropping invalid entry {item.get(key_field)!r}: {str(e)}")
+        if not entries and (value or not allow_empty):
+            raise InvalidPart("no valid entries")
+        return entries
+
+    return validate
+
+
+# part -> validator returning the repaired value or raising InvalidPart
+SCHEMA = {
+    SUMMARY: _text,
+    COMPETENCY_MATCHES: _records(
+        "name",
+        {"name": _text, "match_percentage": _percentage, "description": _optional_text, "reasoning": _optional_text},
+        "match_percentage",
+        allow_empty=False
+    ),
+    AREA_MATCHES: _records("name", {"name": _text, "match_percentage": _percentage}, "match_percentage",
+                           allow_empty=True),
+    FINAL_MATCH: _percentage,
+    AREAS_OF_IMPROVEMENT: _records(
+        "competency",
+        {"competency": _text, "match_percentage": _optional_percentage, "feedback": _text},
+        "feedback",
+        allow_empty=True
+    ),
+}
+
+
+def _unwrap(result):
+    """Unwrap an evaluation the model nested under a single key such as "evaluation" """
+    if result.keys() & SCHEMA.keys() or len(result) != 1:
+        return result
+    inner = next(iter(result.values()))
+    return inner if isinstance(inner, dict) and inner.keys() & SCHEMA.keys() else result
+
+
+def parse_evaluation(raw_response, parts=REQUIRED_PARTS):
+    """Parse model output into (evaluation, missing parts)
+
+    evaluation holds the valid, repaired parts; missing lists the parts of
+    parts that are absent or could not be repaired. Optional parts that fail
+    validation are left out, since the rollups are recomputed locally.
+    """
+    result = load_json_object(raw_response or '')
+
+    evaluation = {}
+    for part, validate in SCHEMA.items():
+        if part not in result:
+            continue
+        try:
+            evaluation[part] = validate(result[part])
+        except InvalidPart as e:
+            print(f"Invalid {part} in evaluation output: {str(e)}")
+    missing = [part for part in parts if part not in evaluation]
+    if missing:
+        print(f"Evaluation output is missing {missing}; raw response: {raw_response}")
+    return evaluation, missing
+
+
+def part_request(prompt, parts):
+    """The prompt restricted to requesting the given parts, or unchanged when all required parts are"""
+    if set(REQUIRED_PARTS) <= set(parts):
+        return prompt
+    return prompt + PART_REQUEST.format(parts=", ".join(parts))
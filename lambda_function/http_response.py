@@ -0,0 +1,112 @@
+import base64
+import gzip
+import json
+import os
+import time
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RESPONSE_COMPRESSION_THRESHOLD = int(os.getenv("RESPONSE_COMPRESSION_THRESHOLD", "1024"))
+RESPONSE_COMPRESSION_LEVEL = int(os.getenv("RESPONSE_COMPRESSION_LEVEL", "6"))
+
+ALLOW_HEADERS = "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token"
+DEFAULT_METHODS = "GET,POST,OPTIONS"
+
+# (methods, allowed headers) -> CORS headers
+_cors_cache = {}
+# (methods, allowed headers) -> preflight response
+_preflight_cache = {}
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    """Serialize data to UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def cors_headers(methods=DEFAULT_METHODS, allow_headers=ALLOW_HEADERS):
+    cache_key = (methods, allow_headers)
+    headers = _cors_cache.get(cache_key)
+    if headers is None:
+        headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Headers": allow_headers,
+            "Access-Control-Allow-Methods": methods,
+            "Content-Type": "application/json"
+        }
+        _cors_cache[cache_key] = headers
+    return headers
+
+
+def is_preflight(event):
+    """True for CORS preflight requests of REST (v1) and HTTP (v2) APIs"""
+    method = event.get('httpMethod') or event.get('requestContext', {}).get('http', {}).get('method')
+    return method == 'OPTIONS'
+
+
+def preflight_response(methods=DEFAULT_METHODS, allow_headers=ALLOW_HEADERS):
+    cache_key = (methods, allow_headers)
+    response = _preflight_cache.get(cache_key)
+    if response is None:
+        response = {'statusCode': 200, 'headers': cors_headers(methods, allow_headers), 'body': '{}'}
+        _preflight_cache[cache_key] = response
+    return dict(response)
+
+
+def accepts_gzip(event):
+    """Whether the request's Accept-Encoding allows gzip (or any encoding) with a non-zero quality"""
+    headers = event.get('headers') or {}
+    accept_encoding = next((value for name, value in headers.items() if name.lower() == 'accept-encoding'), '')
+    for coding in (accept_encoding or '').split(','):
+        name, _, parameters = coding.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            quality = parameters.strip().lower()
+            if not quality.startswith('q='):
+                return True
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return True
+    return False
+
+
+def respond(event, status_code, data, methods=DEFAULT_METHODS, allow_headers=ALLOW_HEADERS):
+    """Serialize data into a proxy response, gzipped when it is large and the client accepts it"""
+    started_at = time.perf_counter()
+    body = dumps(data)
+    serialize_ms = (time.perf_counter() - started_at) * 1000
+
+    headers = dict(cors_headers(methods, allow_headers), **{"Server-Timing": f"serialize;dur={serialize_ms:.2f}"})
+    response = {'statusCode': status_code, 'headers': headers}
+    if len(body) >= RESPONSE_COMPRESSION_THRESHOLD and accepts_gzip(event or {}):
+        compressed = gzip.compress(body, RESPONSE_COMPRESSION_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+        response['body'] = base64.b64encode(compressed).decode('ascii')
+        response['isBase64Encoded'] = True
+        print(f"Serialized {len(body)} bytes in {serialize_ms:.2f}ms, gzipped to {len(compressed)} bytes")
+    else:
+        response['body'] = body.decode('utf-8')
+        print(f"Serialized {len(body)} bytes in {serialize_ms:.2f}ms")
+    return response
+
+
+def success_response(event, data, methods=DEFAULT_METHODS):
+    return respond(event, 200, {"response": data}, methods)
+
+
+def error_response(event, code, message, methods=DEFAULT_METHODS):
+    return respond(event, code, {"error": message}, methods)
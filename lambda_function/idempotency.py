@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+import deadline
+
+IDEMPOTENCY_TABLE = os.getenv("IDEMPOTENCY_TABLE", "Elev8-ai-idempotency")
+# Completed records are served to duplicates for this long; expires_at is the table's TTL attribute
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+
+STATUS_IN_PROGRESS = 'IN_PROGRESS'
+STATUS_COMPLETED = 'COMPLETED'
+
+
+class DuplicateRequestError(Exception):
+    """Raised by claim when the same work is already in flight or completed"""
+
+    def __init__(self, key, status, result=None):
+        super().__init__(f"Duplicate request {key} ({status})")
+        self.key = key
+        self.status = status
+        self.result = result
+
+
+def make_key(scope, *parts):
+    """Stable idempotency key for a unit of work, e.g. make_key('evaluate', email, artifact_hash)"""
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f"{scope}#{digest[:32]}"
+
+
+def _table():
+    return deadline.resource('dynamodb', 5).Table(IDEMPOTENCY_TABLE)
+
+
+def claim(key, lock_seconds):
+    """Claim key for this invocation with a conditional put, returning the owner token release needs
+
+    The claim succeeds if the key is new, its record expired, or a previous
+    claim was left IN_PROGRESS for longer than its lock (a crashed worker).
+    Raises DuplicateRequestError otherwise. Fails open, returning None, when
+    the store is unreachable so an outage does not block uploads and
+    evaluations.
+    """
+    now = int(time.time())
+    owner = uuid.uuid4().hex
+    try:
+        _table().put_item(
+            Item={
+                'idempotency_key': key,
+                'status': STATUS_IN_PROGRESS,
+                'owner': owner,
+                'locked_until': now + lock_seconds,
+                'expires_at': now + max(lock_seconds, IDEMPOTENCY_TTL_SECONDS)
+            },
+            ConditionExpression="attribute_not_exists(idempotency_key) OR expires_at < :now "
+                                "OR (#status = :in_progress AND locked_until < :now)",
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':now': now, ':in_progress': STATUS_IN_PROGRESS}
+        )
+        print(f"Claimed idempotency key {key}")
+        return owner
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            print(f"Idempotency store unavailable, proceeding without a claim: {str(e)}")
+            return None
+    except BotoCoreError as e:
+        print(f"Idempotency store unavailable, proceeding without a claim: {str(e)}")
+        return None
+
+    record = _table().get_item(Key={'idempotency_key': key}, ConsistentRead=True).get('Item', {})
+    result = json.loads(record['result']) if record.get('result') else None
+    raise DuplicateRequestError(key, record.get('status', STATUS_IN_PROGRESS), result)
+
+
+def complete(key, result):
+    """Mark key completed and store the result served to later duplicates"""
+    try:
+        _table().update_item(
+            Key={'idempotency_key': key},
+            UpdateExpression="SET #status = :completed, #result = :result, expires_at = :expires_at "
+                             "REMOVE locked_until",
+            ExpressionAttributeNames={'#status': 'status', '#result': 'result'},
+            ExpressionAttributeValues={
+                ':completed': STATUS_COMPLETED,
+                ':result': json.dumps(result),
+                ':expires_at': int(time.time()) + IDEMPOTENCY_TTL_SECONDS
+            }
+        )
+    except (ClientError, BotoCoreError) as e:
+        print(f"Failed to record completion of {key}: {str(e)}")
+
+
+def release(key, owner):
+    """Drop the in-progress claim owner (claim's return value) holds after a failure so the work can be retried
+
+    Claims held by other invocations are left alone; without an owner there
+    is nothing to release.
+    """
+    if not owner:
+        return
+    try:
+        _table().delete_item(
+            Key={'idempotency_key': key},
+            ConditionExpression="#status = :in_progress AND #owner = :owner",
+            ExpressionAttributeNames={'#status': 'status', '#owner': 'owner'},
+            ExpressionAttributeValues={':in_progress': STATUS_IN_PROGRESS, ':owner': owner}
+        )
+    except (ClientError, BotoCoreError) as e:
+        print(f"Failed to release {key}: {str(e)}")
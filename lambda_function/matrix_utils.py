@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import re
+import time
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+import deadline
+
+S3_BUCKET = "elev8ai"
+MATRIX_FILE = "competency_matrix.json"
+
+# Level the evaluator scores competencies against
+EVALUATION_LEVEL = "P3"
+
+# Seconds a warm container trusts its cached matrix before revalidating with S3
+MATRIX_CACHE_TTL = int(os.getenv("MATRIX_CACHE_TTL", "300"))
+
+LEVEL_KEY_PATTERN = re.compile(r'^P\d+$', re.IGNORECASE)
+DESIGNATION_LEVEL_PATTERN = re.compile(r'\bP\s*-?\s*(\d+)\b', re.IGNORECASE)
+NAME_NORMALIZE_PATTERN = re.compile(r'[^a-z0-9]+')
+
+# Keys describing a matrix node rather than naming one of its children
+META_KEYS = {'weight', 'weights', 'description', 'name', 'title', 'id', 'level', 'levels', 'notes'}
+# Keys that only group children, e.g. {"areas": {...}}, without adding a hierarchy level
+CONTAINER_KEYS = {'categories', 'areas', 'attributes', 'competencies', 'themes'}
+
+# (bucket, key) -> {"matrix", "version", "etag", "checked_at"}
+_matrix_cache = {}
+# (version, levels) -> minified projection text
+_projection_cache = {}
+# (version, levels, shard_by) -> [(shard name, minified sub-matrix text)]
+_shard_cache = {}
+
+
+def _matrix_version(raw_body):
+    """Content hash identifying a matrix revision"""
+    return hashlib.sha256(raw_body).hexdigest()[:16]
+
+
+def load_matrix(bucket=S3_BUCKET, key=MATRIX_FILE, max_age=MATRIX_CACHE_TTL):
+    """Return (matrix, version), reusing the container cache while it is younger than max_age seconds"""
+    cache_key = (bucket, key)
+    cached = _matrix_cache.get(cache_key)
+    if cached and time.time() - cached['checked_at'] < max_age:
+        return cached['matrix'], cached['version']
+
+    request = {'Bucket': bucket, 'Key': key}
+    if cached:
+        request['IfNoneMatch'] = cached['etag']
+
+    try:
+        response = deadline.client('s3', 30).get_object(**request)
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if cached and error_code in ('304', 'NotModified'):
+            cached['checked_at'] = time.time()
+            return cached['matrix'], cached['version']
+        if error_code == 'NoSuchKey':
+            raise Exception(f"The competency matrix file {key} was not found in bucket {bucket}")
+        raise Exception(f"Error retrieving matrix from S3: {str(e)}")
+
+    raw_body = response['Body'].read()
+    try:
+        matrix = json.loads(raw_body.decode('utf-8'))
+    except json.JSONDecodeError:
+        raise Exception("Failed to parse competency matrix JSON file")
+
+    version = _matrix_version(raw_body)
+    _matrix_cache[cache_key] = {
+        'matrix': matrix,
+        'version': version,
+        'etag': response.get('ETag'),
+        'checked_at': time.time()
+    }
+    print(f"Loaded competency matrix version {version}")
+    return matrix, version
+
+
+def designation_level(designation):
+    """Extract the level code (e.g. P4) from a designation, or None"""
+    if not designation:
+        return None
+    match = DESIGNATION_LEVEL_PATTERN.search(str(designation))
+    if not match:
+        return None
+    return f"P{match.group(1)}"
+
+
+def evaluation_levels(from_designation, to_designation):
+    """Levels a projection must keep for a designation pair, sorted"""
+    levels = {EVALUATION_LEVEL}
+    for designation in (from_designation, to_designation):
+        level = designation_level(designation)
+        if level:
+            levels.add(level)
+    return tuple(sorted(levels, key=lambda level: int(level[1:])))
+
+
+def project_matrix(node, levels):
+    """Drop every level-keyed entry of the matrix that is not in levels"""
+    if isinstance(node, dict):
+        projected = {}
+        for key, value in node.items():
+            if LEVEL_KEY_PATTERN.match(str(key)) and str(key).upper() not in levels:
+                continue
+            projected[key] = project_matrix(value, levels)
+        return projected
+    if isinstance(node, list):
+        return [project_matrix(item, levels) for item in node]
+    return node
+
+
+def minify_json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def _cache_version(cache, key, value):
+    """Store a per-version cache entry, dropping entries of superseded matrix versions"""
+    for stale_key in [k for k in cache if k[0] != key[0]]:
+        del cache[stale_key]
+    cache[key] = value
+
+
+def get_matrix_projection(matrix, version, from_designation, to_designation):
+    """Minified matrix slice for a designation pair, cached per matrix version"""
+    levels = evaluation_levels(from_designation, to_designation)
+    cache_key = (version, levels)
+    projection = _projection_cache.get(cache_key)
+    if projection is None:
+        projection = minify_json(project_matrix(matrix, levels))
+        _cache_version(_projection_cache, cache_key, projection)
+        print(f"Built matrix projection for levels {', '.join(levels)} "
+              f"({len(projection)} chars, matrix version {version})")
+    return projection
+
+
+def normalize_name(name):
+    """Canonical form used to match competency names across matrix and model output"""
+    return NAME_NORMALIZE_PATTERN.sub('_', str(name).lower()).strip('_')
+
+
+def _is_level_key(key):
+    return bool(LEVEL_KEY_PATTERN.match(str(key)))
+
+
+def _child_nodes(node):
+    """Yield (name, child) for the hierarchy children of a matrix node"""
+    if isinstance(node, list):
+        for item in node:
+            if isinstance(item, dict) and (item.get('name') or item.get('title')):
+                yield item.get('name') or item.get('title'), item
+            elif isinstance(item, str):
+                yield item, item
+        return
+    if not isinstance(node, dict):
+        return
+    for key, value in node.items():
+        if key in META_KEYS or _is_level_key(key):
+            continue
+        if key in CONTAINER_KEYS:
+            yield from _child_nodes(value)
+        elif isinstance(value, (dict, list, str)):
+            yield key, value
+
+
+def node_weight(node, level):
+    """Weight of a matrix node at a level, defaulting to 1.0"""
+    if not isinstance(node, dict):
+        return 1.0
+    candidates = [node.get('weight')]
+    weights = node.get('weights')
+    if isinstance(weights, dict):
+        candidates.append(weights.get(level))
+    level_entry = node.get(level)
+    if isinstance(level_entry, dict):
+        candidates.append(level_entry.get('weight'))
+    for candidate in candidates:
+        if isinstance(candidate, (int, float)) and not isinstance(candidate, bool):
+            return float(candidate)
+    return 1.0
+
+
+def _applies_to_level(node, level):
+    """False for competencies defined only at other levels"""
+    if not isinstance(node, dict):
+        return True
+    level_keys = [key for key in node if _is_level_key(key)]
+    levels = node.get('levels')
+    if isinstance(levels, dict):
+        level_keys.extend(key for key in levels if _is_level_key(key))
+    return not level_keys or any(str(key).upper() == level for key in level_keys)
+
+
+def iter_competency_nodes(matrix, level=EVALUATION_LEVEL):
+    """Yield (path, weights, node) for every competency of the matrix at a level
+
+    The matrix is read as a category -> area -> ... -> competency hierarchy of
+    nested objects (or lists of named objects); leaves are competencies. path
+    holds the node names from category to competency, weights the weight of
+    each of those nodes and node the competency's own definition.
+    """
+    def walk(node, path, weights):
+        children = list(_child_nodes(node))
+        has_nested = any(not isinstance(child, str) for _, child in children)
+        if not has_nested and (not children or len(path) >= 3):
+            if len(path) >= 2 and _applies_to_level(node, level):
+                yield tuple(path), tuple(weights), node
+            return
+        for name, child in children:
+            yield from walk(child, path + [name], weights + [node_weight(child, level)])
+
+    yield from walk(matrix, [], [])
+
+
+def competency_names(paths):
+    """Name the evaluator reports for each competency path: its key, or area/key where keys collide"""
+    counts = Counter(normalize_name(path[-1]) for path in paths)
+    return [f"{path[-2]}/{path[-1]}" if counts[normalize_name(path[-1])] > 1 else path[-1] for path in paths]
+
+
+def iter_competencies(matrix, level=EVALUATION_LEVEL):
+    """Yield (path, weights) for every competency of the matrix at a level"""
+    for path, weights, _ in iter_competency_nodes(matrix, level):
+        yield path, weights
+
+
+def split_matrix(matrix, shard_by='category'):
+    """Split a matrix into (name, sub-matrix) shards, one per category or per area"""
+    shards = []
+    for category, category_node in _child_nodes(matrix):
+        if isinstance(category_node, str):
+            continue
+        if shard_by == 'area' and isinstance(category_node, dict):
+            # Keep the category's own weights and descriptions next to each of its areas
+            category_meta = {key: value for key, value in category_node.items()
+                             if key in META_KEYS or _is_level_key(key)}
+            for area, area_node in _child_nodes(category_node):
+                shards.append((f"{category}/{area}", {category: dict(category_meta, **{area: area_node})}))
+        else:
+            shards.append((category, {category: category_node}))
+    return shards
+
+
+def get_matrix_shards(matrix, version, from_designation, to_designation, shard_by='category'):
+    """Minified projections of each matrix category or area, cached per matrix version"""
+    levels = evaluation_levels(from_designation, to_designation)
+    cache_key = (version, levels, shard_by)
+    shards = _shard_cache.get(cache_key)
+    if shards is None:
+        projected = project_matrix(matrix, levels)
+        shards = [(name, minify_json(sub_matrix)) for name, sub_matrix in split_matrix(projected, shard_by)]
+        _cache_version(_shard_cache, cache_key, shards)
+        print(f"Split matrix version {version} into {len(shards)} {shard_by} shards")
+    return shards
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+
+from botocore.exceptions import ClientError
+
+import deadline
+from matrix_utils import (
+    S3_BUCKET, competency_names, iter_competency_nodes, minify_json, normalize_name, project_matrix
+)
+
+MATRIX_SNAPSHOT_PREFIX = os.getenv("MATRIX_SNAPSHOT_PREFIX", "matrix-versions/")
+WEIGHT_KEYS = {'weight', 'weights'}
+
+# version -> matrix; a version's content never changes
+_snapshot_cache = {}
+# (version, levels) -> {normalized competency name: definition hash}
+_fingerprint_cache = {}
+
+
+def snapshot_key(version):
+    return f"{MATRIX_SNAPSHOT_PREFIX}{version}.json"
+
+
+def save_snapshot(matrix, version, bucket=S3_BUCKET):
+    """Store a matrix under its version once per container; returns False if it could not be stored"""
+    if version in _snapshot_cache:
+        return True
+    try:
+        # A conditional write leaves a snapshot stored by another container untouched
+        deadline.client('s3', 10).put_object(
+            Bucket=bucket,
+            Key=snapshot_key(version),
+            ContentType='application/json',
+            Body=json.dumps(matrix),
+            IfNoneMatch='*'
+        )
+        print(f"Stored matrix snapshot {version}")
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+            print(f"Error storing matrix snapshot {version}: {str(e)}")
+            return False
+    _snapshot_cache[version] = matrix
+    return True
+
+
+def load_snapshot(version, bucket=S3_BUCKET):
+    """The matrix of a version, or None when no snapshot of it was stored"""
+    matrix = _snapshot_cache.get(version)
+    if matrix is None:
+        try:
+            response = deadline.client('s3', 30).get_object(Bucket=bucket, Key=snapshot_key(version))
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return None
+            raise
+        matrix = json.loads(response['Body'].read())
+        _snapshot_cache[version] = matrix
+    return matrix
+
+
+def _strip_weights(node):
+    if isinstance(node, dict):
+        return {key: _strip_weights(value) for key, value in node.items() if key not in WEIGHT_KEYS}
+    if isinstance(node, list):
+        return [_strip_weights(item) for item in node]
+    return node
+
+
+def _named_nodes(matrix):
+    """(evaluator name, path, node) of every competency; colliding keys are named area/competency"""
+    nodes = [(path, node) for path, _, node in iter_competency_nodes(matrix)]
+    return [(name, path, node) for name, (path, node) in zip(competency_names([path for path, _ in nodes]), nodes)]
+
+
+def competency_fingerprints(matrix, version, levels):
+    """Hash of each competency's definition at the given levels, weights excluded, cached per version"""
+    cache_key = (version, levels)
+    fingerprints = _fingerprint_cache.get(cache_key)
+    if fingerprints is None:
+        fingerprints = {}
+        for name, _, node in _named_nodes(matrix):
+            definition = minify_json(_strip_weights(project_matrix(node, levels)))
+            fingerprints[normalize_name(name)] = hashlib.sha256(definition.encode('utf-8')).hexdigest()[:16]
+        _fingerprint_cache[cache_key] = fingerprints
+    return fingerprints
+
+
+def diff_matrices(old_matrix, old_version, new_matrix, new_version, levels):
+    """Competencies (normalized names) that were changed, added or removed between two matrix versions
+
+    Returns {"changed": [...], "added": [...], "removed": [...]}, each in
+    matrix order. Competencies that only moved or were reweighted are not
+    reported.
+    """
+    old = competency_fingerprints(old_matrix, old_version, levels)
+    new = competency_fingerprints(new_matrix, new_version, levels)
+    return {
+        "changed": [name for name, fingerprint in new.items() if name in old and old[name] != fingerprint],
+        "added": [name for name in new if name not in old],
+        "removed": [name for name in old if name not in new]
+    }
+
+
+def competency_subset(matrix, names):
+    """The category -> area -> competency hierarchy of only the named competencies (normalized names)"""
+    subset = {}
+    for competency, path, node in _named_nodes(matrix):
+        if normalize_name(competency) not in names:
+            continue
+        parent = subset
+        for name in path[:-1]:
+            parent = parent.setdefault(name, {})
+        parent[path[-1]] = node
+    return subset
@@ -0,0 +1,74 @@
+import os
+import re
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts')
+
+SLOT_PATTERN = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+INLINE_WHITESPACE_PATTERN = re.compile(r'[ \t]+')
+
+# Version used for a template when <NAME>_PROMPT_VERSION is not set
+DEFAULT_VERSIONS = {
+    "evaluator": "v3"
+}
+
+# (name, version) -> PromptTemplate, filled once per container
+_template_cache = {}
+
+
+def minify_whitespace(text):
+    """Strip indentation, collapse inline whitespace and drop blank lines"""
+    lines = (INLINE_WHITESPACE_PATTERN.sub(' ', line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) for comparing template versions"""
+    return (len(text) + 3) // 4
+
+
+class PromptTemplate:
+    """A minified prompt split into static text and named slots at load time"""
+
+    def __init__(self, name, version, source):
+        self.name = name
+        self.version = version
+        text = minify_whitespace(source)
+
+        # Even indices are static text, odd indices are slot names
+        self._parts = SLOT_PATTERN.split(text)
+        self.slots = frozenset(self._parts[1::2])
+        self.static_tokens = estimate_tokens("".join(self._parts[0::2]))
+
+    @property
+    def template_id(self):
+        return f"{self.name}:{self.version}"
+
+    def render(self, **values):
+        missing = self.slots - values.keys()
+        if missing:
+            raise Exception(f"Missing values for prompt slots {sorted(missing)} in {self.template_id}")
+
+        rendered = list(self._parts)
+        for index in range(1, len(rendered), 2):
+            rendered[index] = str(values[rendered[index]])
+        return "".join(rendered)
+
+
+def get_template(name, version=None):
+    """Load prompts/<name>_<version>.txt once per container"""
+    version = version or os.getenv(f"{name.upper()}_PROMPT_VERSION", DEFAULT_VERSIONS.get(name, "v1"))
+    cache_key = (name, version)
+    template = _template_cache.get(cache_key)
+    if template is None:
+        path = os.path.join(PROMPTS_DIR, f"{name}_{version}.txt")
+        try:
+            with open(path, encoding='utf-8') as template_file:
+                source = template_file.read()
+        except FileNotFoundError:
+            raise Exception(f"Prompt template {name} version {version} not found at {path}")
+
+        template = PromptTemplate(name, version, source)
+        _template_cache[cache_key] = template
+        print(f"Loaded prompt template {template.template_id} "
+              f"(~{estimate_tokens(source)} tokens raw, ~{template.static_tokens} tokens minified static text)")
+    return template
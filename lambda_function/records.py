@@ -0,0 +1,177 @@
+import os
+import time
+
+import deadline
+from dynamo_utils import batch_put_items
+
+RECORDS_TABLE = os.getenv("RECORDS_TABLE", "Elev8-ai-records")
+LEGACY_TABLE = 'Elev8-ai-summary'
+LEGACY_FALLBACK = os.getenv("LEGACY_FALLBACK", "true").lower() != "false"
+
+SK_STATUS = 'STATUS'
+SUMMARY_PREFIX = 'SUMMARY#'
+CHAT_PREFIX = 'CHAT#'
+KEY_NAMES = ['email', 'sk']
+# Sparse GSI over STATUS items only (partition key USER_INDEX_KEY, sort key email, keys-only projection)
+USERS_INDEX = os.getenv("USERS_INDEX", "users-index")
+USER_INDEX_KEY = 'user_index'
+USER_INDEX_VALUE = 'USER'
+
+
+def summary_sk(evaluated_at):
+    # Zero-padded so sort key order is time order
+    return f"{SUMMARY_PREFIX}{int(evaluated_at):013d}"
+
+
+def chat_sk(timestamp):
+    return f"{CHAT_PREFIX}{int(timestamp):013d}"
+
+
+def _table(cap=5, table_name=RECORDS_TABLE):
+    return deadline.resource('dynamodb', cap).Table(table_name)
+
+
+def _projection(attributes):
+    """ProjectionExpression arguments for attribute names, which may be reserved words"""
+    if not attributes:
+        return {}
+    names = {f"#p{position}": name for position, name in enumerate(attributes)}
+    return {'ProjectionExpression': ", ".join(names), 'ExpressionAttributeNames': names}
+
+
+def _legacy_item(email, attributes):
+    if not LEGACY_FALLBACK:
+        return None
+    return _table(table_name=LEGACY_TABLE).get_item(Key={'email': email}, **_projection(attributes)).get('Item')
+
+
+def update_status(email, values, remove=()):
+    """Set STATUS attributes (None values are skipped) and remove others, leaving the rest as they are"""
+    values = {name: value for name, value in values.items() if value is not None}
+    # Only STATUS items carry the index key, which keeps USERS_INDEX down to one entry per user
+    values[USER_INDEX_KEY] = USER_INDEX_VALUE
+    names = {}
+    clauses = []
+    attribute_values = {}
+    for position, (name, value) in enumerate(values.items()):
+        names[f"#s{position}"] = name
+        attribute_values[f":s{position}"] = value
+        clauses.append(f"#s{position} = :s{position}")
+    update_expression = "SET " + ", ".join(clauses) if clauses else ""
+    if remove:
+        for position, name in enumerate(remove):
+            names[f"#r{position}"] = name
+        update_expression += " REMOVE " + ", ".join(f"#r{position}" for position in range(len(remove)))
+
+    _table().update_item(
+        Key={'email': email, 'sk': SK_STATUS},
+        UpdateExpression=update_expression.strip(),
+        ExpressionAttributeNames=names,
+        **({'ExpressionAttributeValues': attribute_values} if attribute_values else {})
+    )
+
+
+def get_status(email, attributes=None):
+    """The user's STATUS record, optionally projected, or None"""
+    item = _table().get_item(Key={'email': email, 'sk': SK_STATUS}, **_projection(attributes)).get('Item')
+    return item if item is not None else _legacy_item(email, attributes)
+
+
+def summary_item(email, summary_json, prompt_version, matrix_version, evaluated_at=None,
+                 from_designation=None, to_designation=None):
+    evaluated_at = evaluated_at or int(time.time() * 1000)
+    item = {
+        'email': email,
+        'sk': summary_sk(evaluated_at),
+        'summary_json': summary_json,
+        'prompt_version': prompt_version,
+        'matrix_version': matrix_version,
+        'evaluated_at': evaluated_at
+    }
+    # The designations select the matrix levels a re-evaluation compares
+    if from_designation:
+        item['from_designation'] = from_designation
+    if to_designation:
+        item['to_designation'] = to_designation
+    return item
+
+
+def put_summary(email, summary_json, prompt_version, matrix_version, evaluated_at=None,
+                from_designation=None, to_designation=None):
+    """Store an evaluation as a new SUMMARY record and return it"""
+    item = summary_item(email, summary_json, prompt_version, matrix_version, evaluated_at,
+                        from_designation, to_designation)
+    _table(10).put_item(Item=item)
+    return item
+
+
+def get_latest_summary(email, attributes=None):
+    """The user's most recent SUMMARY record, optionally projected, or None"""
+    items = _table(10).query(
+        KeyConditionExpression="email = :email AND begins_with(sk, :prefix)",
+        ExpressionAttributeValues={':email': email, ':prefix': SUMMARY_PREFIX},
+        ScanIndexForward=False,
+        Limit=1,
+        **_projection(attributes)
+    ).get('Items', [])
+    if items:
+        return items[0]
+    item = _legacy_item(email, attributes)
+    return item if item and item.get('summary_json') is not None else None
+
+
+def chat_item(record):
+    return dict(record, sk=chat_sk(record['timestamp']))
+
+
+def put_chat(record):
+    _table().put_item(Item=chat_item(record))
+
+
+def put_chats(records):
+    """Store chat interactions with BatchWriteItem; each is its own item, so nothing is read first"""
+    return batch_put_items(RECORDS_TABLE, [chat_item(record) for record in records], KEY_NAMES)
+
+
+def get_chat_history(email, limit=5, attributes=None):
+    """The user's latest chat interactions, newest first"""
+    return _table().query(
+        KeyConditionExpression="email = :email AND begins_with(sk, :prefix)",
+        ExpressionAttributeValues={':email': email, ':prefix': CHAT_PREFIX},
+        ScanIndexForward=False,
+        Limit=limit,
+        **_projection(attributes)
+    ).get('Items', [])
+
+
+def _scan_emails(table):
+    emails = []
+    kwargs = {}
+    while True:
+        response = table.scan(ProjectionExpression="email", **kwargs)
+        emails.extend(item['email'] for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return emails
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def list_emails():
+    """Emails of all users with a STATUS record (and, until migrated, a legacy item)"""
+    table = _table(20)
+    emails = []
+    kwargs = {}
+    while True:
+        response = table.query(
+            IndexName=USERS_INDEX,
+            KeyConditionExpression="#key = :user",
+            ExpressionAttributeNames={'#key': USER_INDEX_KEY},
+            ExpressionAttributeValues={':user': USER_INDEX_VALUE},
+            **kwargs
+        )
+        emails.extend(item['email'] for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    if LEGACY_FALLBACK:
+        emails.extend(_scan_emails(_table(20, LEGACY_TABLE)))
+    return list(dict.fromkeys(emails))
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+import deadline
+from answer_cache import question_tokens
+from bedrock_admission import PRIORITY_BACKGROUND, call_bedrock
+from matrix_utils import S3_BUCKET
+from retrieval_policy import vector_search_configuration
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "split")
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", "86400"))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "200"))
+RETRIEVAL_CACHE_PREFIX = os.getenv("RETRIEVAL_CACHE_PREFIX", "retrieval-cache/")
+GENERATION_MAX_TOKENS = int(os.getenv("GENERATION_MAX_TOKENS", "4096"))
+# The one retrieval of a user's artifacts, shared by the evaluator and the chatbot's personal questions
+CANDIDATE_SEARCH_RESULTS = 50
+CANDIDATE_SEARCH_TYPE = "SEMANTIC"
+
+# Placeholder retrieve_and_generate prompt templates use for the retrieved chunks
+SEARCH_RESULTS_PLACEHOLDER = "$search_results$"
+
+# cache key -> {"chunks", "number_of_results", "stored_at"}
+_local_cache = OrderedDict()
+
+
+def cache_key(knowledge_base_id, retrieval, query, artifact_hash):
+    """Cache key for a retrieval, or None when its results cannot be tied to one artifact version"""
+    if not retrieval.get("user_email") or not artifact_hash:
+        return None
+    parts = (knowledge_base_id, retrieval["user_email"], artifact_hash, retrieval["search_type"], query)
+    return hashlib.sha256("|".join(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def _fresh(entry, number_of_results):
+    return (entry and entry['number_of_results'] >= number_of_results
+            and time.time() - entry['stored_at'] < RETRIEVAL_CACHE_TTL)
+
+
+def _read_persistent(key):
+    try:
+        response = deadline.client('s3', 5).get_object(Bucket=S3_BUCKET, Key=f"{RETRIEVAL_CACHE_PREFIX}{key}.json")
+        return json.loads(response['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            print(f"Error reading retrieval cache: {str(e)}")
+    except Exception as e:
+        print(f"Error reading retrieval cache: {str(e)}")
+    return None
+
+
+def _write_persistent(key, entry):
+    try:
+        deadline.client('s3', 5).put_object(
+            Bucket=S3_BUCKET,
+            Key=f"{RETRIEVAL_CACHE_PREFIX}{key}.json",
+            Body=json.dumps(entry).encode('utf-8'),
+            ContentType='application/json'
+        )
+    except Exception as e:
+        print(f"Error writing retrieval cache: {str(e)}")
+
+
+def _store_local(key, entry):
+    _local_cache[key] = entry
+    _local_cache.move_to_end(key)
+    while len(_local_cache) > RETRIEVAL_CACHE_MAX_ENTRIES:
+        _local_cache.popitem(last=False)
+
+
+def retrieve(client, knowledge_base_id, query, vector_search_configuration, priority=PRIORITY_BACKGROUND):
+    """Run one knowledge-base retrieval and return its chunks, best first"""
+    response = call_bedrock(
+        client,
+        "retrieve",
+        priority,
+        knowledgeBaseId=knowledge_base_id,
+        retrievalQuery={"text": query},
+        retrievalConfiguration={"vectorSearchConfiguration": vector_search_configuration}
+    )
+    return [
+        {
+            "text": result.get("content", {}).get("text", ""),
+            "score": result.get("score"),
+            "location": result.get("location")
+        }
+        for result in response.get("retrievalResults", [])
+    ]
+
+
+def retrieve_chunks(client, knowledge_base_id, query, retrieval, vector_search_configuration,
+                    artifact_hash=None, priority=PRIORITY_BACKGROUND):
+    """Chunks for a query, served from the local or persistent cache when possible
+
+    Returns (chunks, cached) where cached names the tier that served the
+    chunks ("local" or "persistent"), or is None for a fresh retrieval.
+    """
+    number_of_results = retrieval["number_of_results"]
+    key = cache_key(knowledge_base_id, retrieval, query, artifact_hash)
+    if key:
+        entry = _local_cache.get(key)
+        if _fresh(entry, number_of_results):
+            _local_cache.move_to_end(key)
+            return entry['chunks'][:number_of_results], "local"
+        entry = _read_persistent(key)
+        if _fresh(entry, number_of_results):
+            _store_local(key, entry)
+            return entry['chunks'][:number_of_results], "persistent"
+
+    chunks = retrieve(client, knowledge_base_id, query, vector_search_configuration, priority)
+    print(f"Retrieved {len(chunks)} chunks ({retrieval['search_type']}, k={number_of_results})")
+    if key:
+        entry = {"chunks": chunks, "number_of_results": number_of_results, "stored_at": time.time()}
+        _store_local(key, entry)
+        _write_persistent(key, entry)
+    return chunks, None
+
+
+def candidate_retrieval(candidate_email):
+    """Retrieval settings of the candidate's artifacts, queried by their email"""
+    return {
+        "query_class": "evaluation",
+        "number_of_results": CANDIDATE_SEARCH_RESULTS,
+        "search_type": CANDIDATE_SEARCH_TYPE,
+        "user_email": candidate_email,
+        "query": candidate_email
+    }
+
+
+def candidate_chunks(client, knowledge_base_id, candidate_email, artifact_hash=None, priority=PRIORITY_BACKGROUND):
+    """The candidate's chunks from one retrieval per artifact version; returns (chunks, cached) like retrieve_chunks"""
+    retrieval = candidate_retrieval(candidate_email)
+    return retrieve_chunks(
+        client, knowledge_base_id, retrieval["query"], retrieval, vector_search_configuration(retrieval),
+        artifact_hash=artifact_hash, priority=priority
+    )
+
+
+def rank_chunks(question, chunks, limit):
+    """The limit chunks sharing the most content words with question; ties keep their retrieval order"""
+    words = set(question_tokens(question))
+    ranked = sorted(
+        enumerate(chunks),
+        key=lambda item: (-len(words.intersection(question_tokens(item[1]['text']))), item[0])
+    )
+    return [chunk for _, chunk in ranked[:limit]]
+
+
+def format_chunks(chunks):
+    return "\n\n".join(f"[{position}] {chunk['text']}" for position, chunk in enumerate(chunks, 1))
+
+
+def generate_from_chunks(client, model_arn, prompt, chunks, priority=PRIORITY_BACKGROUND,
+                         max_tokens=GENERATION_MAX_TOKENS):
+    """Generate an answer to prompt grounded on already retrieved chunks
+
+    The chunks replace $search_results$ when the prompt has it, as evaluator
+    templates do, and are prepended otherwise.
+    """
+    search_results = format_chunks(chunks)
+    if SEARCH_RESULTS_PLACEHOLDER in prompt:
+        text = prompt.replace(SEARCH_RESULTS_PLACEHOLDER, search_results)
+    else:
+        text = f"Retrieved Knowledge:\n{search_results}\n\n{prompt}"
+
+    response = call_bedrock(
+        client,
+        "converse",
+        priority,
+        service="bedrock-runtime",
+        modelId=model_arn,
+        messages=[{"role": "user", "content": [{"text": text}]}],
+        inferenceConfig={"maxTokens": max_tokens}
+    )
+    content = response["output"]["message"]["content"]
+    return "".join(block.get("text", "") for block in content).strip()
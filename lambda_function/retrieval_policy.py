@@ -0,0 +1,122 @@
+import json
+import os
+import re
+import time
+
+from candidate_context import is_candidate_question
+
+QUERY_PERSONAL = "personal"
+QUERY_MATRIX = "matrix"
+QUERY_GENERAL = "general"
+
+RETRIEVAL_SCOPE_TO_USER = os.getenv("RETRIEVAL_SCOPE_TO_USER", "true").lower() != "false"
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "Elev8ai/Chatbot")
+
+MATRIX_QUESTION_PATTERN = re.compile(
+    r"\b(matrix|competenc\w*|levels?|p\s*-?\s*\d+|categor\w*|areas?|skills?|expect\w*|"
+    r"designations?|roles?|senior\w*|junior|principal|staff|weights?)\b",
+    re.IGNORECASE
+)
+
+DEFAULT_POLICIES = {
+    # Personal answers lean on the candidate's artifacts, where wording varies too much for keyword matching
+    QUERY_PERSONAL: {"number_of_results": 20, "search_type": "SEMANTIC"},
+    # Matrix answers come mostly from the matrix in the prompt; keywords catch level names like P4
+    QUERY_MATRIX: {"number_of_results": 5, "search_type": "HYBRID"},
+    # General questions often name a tool or term that keyword matching finds more reliably
+    QUERY_GENERAL: {"number_of_results": 10, "search_type": "HYBRID"},
+}
+# A stored-evaluation digest already covers the candidate, so fewer chunks are needed alongside it
+DIGEST_NUMBER_OF_RESULTS = 10
+
+
+def _load_policies():
+    policies = {name: dict(policy) for name, policy in DEFAULT_POLICIES.items()}
+    try:
+        overrides = json.loads(os.getenv("RETRIEVAL_POLICY_OVERRIDES") or "{}")
+    except ValueError as e:
+        print(f"Ignoring invalid RETRIEVAL_POLICY_OVERRIDES: {str(e)}")
+        overrides = {}
+    for name, override in overrides.items():
+        if name in policies and isinstance(override, dict):
+            policies[name].update(override)
+    return policies
+
+
+POLICIES = _load_policies()
+
+
+def is_matrix_question(question):
+    return bool(MATRIX_QUESTION_PATTERN.search(question or ''))
+
+
+def classify_question(question):
+    if is_candidate_question(question):
+        return QUERY_PERSONAL
+    if is_matrix_question(question):
+        return QUERY_MATRIX
+    return QUERY_GENERAL
+
+
+def choose_retrieval(question, user_email, has_digest=False):
+    """Retrieval settings for a question: {"query_class", "number_of_results", "search_type", "user_email", "query"}
+
+    user_email is None when retrieval is not scoped to the user. Every class
+    queries with the question text.
+    """
+    query_class = classify_question(question)
+    policy = POLICIES[query_class]
+    number_of_results = policy["number_of_results"]
+    if has_digest:
+        number_of_results = min(number_of_results, DIGEST_NUMBER_OF_RESULTS)
+    scoped_email = user_email if RETRIEVAL_SCOPE_TO_USER else None
+    return {
+        "query_class": query_class,
+        "number_of_results": number_of_results,
+        "search_type": policy["search_type"],
+        "user_email": scoped_email,
+        "query": question
+    }
+
+
+def vector_search_configuration(retrieval):
+    """vectorSearchConfiguration for retrieve and retrieve_and_generate, filtered on the email metadata like the evaluator"""
+    configuration = {
+        "numberOfResults": retrieval["number_of_results"],
+        "overrideSearchType": retrieval["search_type"]
+    }
+    if retrieval["user_email"]:
+        configuration["filter"] = {
+            "equals": {
+                "key": "email",
+                "value": retrieval["user_email"]
+            }
+        }
+    return configuration
+
+
+def record_retrieval(retrieval, retrieved_chunks, latency_ms, prompt_chars, used_digest, retrieval_cached=None):
+    """Log the number of chunks the answer was grounded on against its latency as a CloudWatch embedded metric"""
+    print(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["QueryClass"], ["QueryClass", "SearchType"]],
+                "Metrics": [
+                    {"Name": "RetrievedChunks", "Unit": "Count"},
+                    {"Name": "AnswerLatency", "Unit": "Milliseconds"},
+                    {"Name": "PromptChars", "Unit": "Count"}
+                ]
+            }]
+        },
+        "QueryClass": retrieval["query_class"],
+        "SearchType": retrieval["search_type"],
+        "RetrievedChunks": retrieved_chunks,
+        "RequestedChunks": retrieval["number_of_results"],
+        "AnswerLatency": round(latency_ms, 1),
+        "PromptChars": prompt_chars,
+        "ScopedToUser": bool(retrieval["user_email"]),
+        "UsedDigest": used_digest,
+        "RetrievalCache": retrieval_cached or "miss"
+    }))
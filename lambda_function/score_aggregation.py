@@ -0,0 +1,184 @@
+import re
+
+from matrix_utils import EVALUATION_LEVEL, competency_names, iter_competencies, normalize_name
+
+NO_EVIDENCE = "No evidence found in artifacts"
+PERCENTAGE_PATTERN = re.compile(r'-?\d+(?:\.\d+)?')
+
+# (matrix version, level) -> MatrixIndex
+_index_cache = {}
+
+
+class MatrixIndex:
+    """Flattened competency -> area -> category hierarchy with parallel weight arrays"""
+
+    def __init__(self, matrix, level):
+        self.competencies = []
+        self.competency_area = []
+        self.competency_weights = []
+        self.areas = []
+        self.area_category = []
+        self.area_weights = []
+        self.categories = []
+        self.category_weights = []
+        self.paths = []
+        self.positions = {}
+        # normalized competency key -> positions sharing it, for names reported without their area
+        self.key_positions = {}
+
+        area_positions = {}
+        category_positions = {}
+        for path, weights in iter_competencies(matrix, level):
+            category, category_weight = path[0], weights[0]
+            if len(path) > 2:
+                area, area_weight, own_weights = path[1], weights[1], weights[2:]
+            else:
+                area, area_weight, own_weights = path[0], 1.0, weights[1:]
+            # Intermediate levels such as attributes scale the competency weight within its area
+            competency_weight = 1.0
+            for weight in own_weights:
+                competency_weight *= weight
+
+            if category not in category_positions:
+                category_positions[category] = len(self.categories)
+                self.categories.append(category)
+                self.category_weights.append(category_weight)
+
+            area_key = (category, area)
+            if area_key not in area_positions:
+                area_positions[area_key] = len(self.areas)
+                self.areas.append(area)
+                self.area_category.append(category_positions[category])
+                self.area_weights.append(area_weight)
+
+            self.paths.append(path)
+            self.competency_area.append(area_positions[area_key])
+            self.competency_weights.append(competency_weight)
+
+        self.competencies = competency_names(self.paths)
+        for position, name in enumerate(self.competencies):
+            self.positions.setdefault(normalize_name(name), position)
+            self.key_positions.setdefault(normalize_name(self.paths[position][-1]), []).append(position)
+        duplicates = sorted(name for name in self.competencies if '/' in name)
+        if duplicates:
+            print(f"Competency keys used in several areas are named area/competency: {', '.join(duplicates)}")
+
+
+def get_matrix_index(matrix, version, level=EVALUATION_LEVEL):
+    """MatrixIndex for a matrix version, built once per container"""
+    cache_key = (version, level)
+    index = _index_cache.get(cache_key)
+    if index is None:
+        index = MatrixIndex(matrix, level)
+        for stale_key in [k for k in _index_cache if k[0] != version]:
+            del _index_cache[stale_key]
+        _index_cache[cache_key] = index
+        print(f"Indexed {len(index.competencies)} competencies in {len(index.areas)} areas "
+              f"and {len(index.categories)} categories (matrix version {version})")
+    return index
+
+
+def parse_percentage(value):
+    """Clamp a model-reported percentage (85, 85.0, "85%") to 0-100"""
+    if isinstance(value, bool):
+        return 0.0
+    if not isinstance(value, (int, float)):
+        match = PERCENTAGE_PATTERN.search(str(value or ''))
+        value = float(match.group()) if match else 0.0
+    return min(max(float(value), 0.0), 100.0)
+
+
+def _weighted_means(values, weights, groups, group_count):
+    totals = [0.0] * group_count
+    weight_totals = [0.0] * group_count
+    for value, weight, group in zip(values, weights, groups):
+        totals[group] += value * weight
+        weight_totals[group] += weight
+    return [total / weight_total if weight_total else 0.0
+            for total, weight_total in zip(totals, weight_totals)]
+
+
+def competency_match_list(competency_matches):
+    """Accept competency_matches as a list of objects or a name-keyed object"""
+    if isinstance(competency_matches, dict):
+        return [dict(match, name=name) if isinstance(match, dict) else {"name": name, "match_percentage": match}
+                for name, match in competency_matches.items()]
+    if isinstance(competency_matches, list):
+        return [match for match in competency_matches if isinstance(match, dict)]
+    return []
+
+
+def qualify_names(entries, key_field, index, prefix=(), names=None):
+    """Give entries that report a shared competency key without its area their area/competency name
+
+    Candidates are limited to paths under prefix (a shard's category or
+    area) and, when given, to the normalized names in names. The first
+    candidate in matrix order that no other entry reports is taken.
+    """
+    taken = {index.positions.get(normalize_name(entry.get(key_field, ''))) for entry in entries}
+    for entry in entries:
+        key = normalize_name(entry.get(key_field, ''))
+        if key in index.positions:
+            continue
+        candidates = [
+            position for position in index.key_positions.get(key, [])
+            if position not in taken
+            and index.paths[position][:len(prefix)] == prefix
+            and (names is None or normalize_name(index.competencies[position]) in names)
+        ]
+        if candidates:
+            taken.add(candidates[0])
+            entry[key_field] = index.competencies[candidates[0]]
+    return entries
+
+
+def aggregate_scores(assessment, index):
+    """Replace model-computed rollups with area, category and final scores derived from the matrix weights
+
+    Competencies the model did not report score 0, matching the "no evidence
+    means 0%" rule of the evaluator prompt. Matches that do not correspond to
+    a matrix competency are kept but do not count towards the rollups.
+    """
+    if not index.competencies:
+        print("Matrix index has no competencies, keeping model-computed rollups")
+        return assessment
+
+    scores = [0.0] * len(index.competencies)
+    reported = [None] * len(index.competencies)
+    unmatched = []
+    improvements = assessment.get('areas_of_improvement')
+    if isinstance(improvements, list):
+        qualify_names([entry for entry in improvements if isinstance(entry, dict)], 'competency', index)
+    for match in qualify_names(competency_match_list(assessment.get('competency_matches')), 'name', index):
+        position = index.positions.get(normalize_name(match.get('name', '')))
+        if position is None:
+            unmatched.append(match)
+            continue
+        match['match_percentage'] = parse_percentage(match.get('match_percentage'))
+        scores[position] = match['match_percentage']
+        reported[position] = match
+
+    competency_matches = []
+    for position, name in enumerate(index.competencies):
+        competency_matches.append(reported[position] or {
+            "name": name,
+            "description": "",
+            "match_percentage": 0.0,
+            "reasoning": NO_EVIDENCE
+        })
+
+    area_scores = _weighted_means(scores, index.competency_weights, index.competency_area, len(index.areas))
+    category_scores = _weighted_means(area_scores, index.area_weights, index.area_category, len(index.categories))
+    final_scores = _weighted_means(category_scores, index.category_weights, [0] * len(index.categories), 1)
+
+    assessment['competency_matches'] = competency_matches + unmatched
+    assessment['area_matches'] = [
+        {"name": name, "match_percentage": round(score, 1)}
+        for name, score in zip(index.areas, area_scores)
+    ]
+    assessment['category_matches'] = [
+        {"name": name, "match_percentage": round(score, 1)}
+        for name, score in zip(index.categories, category_scores)
+    ]
+    assessment['final_match'] = round(final_scores[0], 1)
+    return assessment